@@ -6,27 +6,44 @@
 # imports
 from __future__ import print_function
 from sage.all import (QQ,
+                      ZZ,
                       SR,
                       Integer,
                       vector,
                       gcd,
+                      lcm,
                       factor,
                       flatten,
                       PolynomialRing,
                       LaurentSeriesRing,
+                      PowerSeriesRing,
                       gens,
                       var,
                       latex,
                       sqrt,
                       solve,
                       O,
-                      randint)
+                      randint,
+                      prod,
+                      parallel)
 from sage.rings.polynomial.polynomial_element import is_Polynomial
 from sage.rings.polynomial.multi_polynomial_element import is_MPolynomial
 from sage.rings.laurent_series_ring_element import is_LaurentSeries
 from sage.rings.polynomial.polynomial_ring import is_PolynomialRing
+from sage.rings.fraction_field import is_FractionField
+from sage.matrix.matrix import is_Matrix
+from sage.structure.factorization import Factorization
 from sage.rings.number_field.number_field_element import is_NumberFieldElement
 import re
+import numpy
+import os
+import threading
+import time
+import shelve
+import hashlib
+import weakref
+from copy import copy
+from collections import OrderedDict
 
 # wildcards
 w = map(SR.wild, xrange(20))
@@ -64,6 +81,54 @@ def chunks(l, n=2):
     return [l[i:i + n] for i in range(0, len(l), n)]
 
 
+def parallel_imap(fn, lst, workers=None, timeout=0):
+    """Apply fn to the items of lst, and yield pairs of the index and
+    the result as soon as they are computed. If workers is larger than
+    1, distribute the items over that many forked processes (using
+    sage's parallel decorator), so the order is arbitrary. Closing the
+    generator early kills the remaining workers. As we fork, fn may be
+    a closure, but its results must be picklable.
+
+    With a timeout (in seconds), we always fork, and an item taking
+    longer gets the result 'NO DATA (timed out)' (see parallel_failed).
+    """
+    lst = list(lst)
+    if (workers is None or workers <= 1 or len(lst) <= 1) and not timeout:
+        for (i, x) in enumerate(lst):
+            yield i, fn(x)
+        return
+
+    @parallel(p_iter='fork', ncpus=max(workers or 1, 1), timeout=timeout)
+    def pfn(i):
+        return fn(lst[i])
+
+    results = pfn(range(len(lst)))
+    try:
+        for ((args, kwds), r) in results:
+            yield args[0], r
+    finally:
+        results.close()
+
+
+def parallel_map(fn, lst, workers=None, timeout=0):
+    """Like map, but if workers is larger than 1, distribute the items of
+    lst over that many forked processes (see parallel_imap). The
+    results are returned in the order of lst."""
+    lst = list(lst)
+    if (workers is None or workers <= 1 or len(lst) <= 1) and not timeout:
+        return map(fn, lst)
+    results = [None] * len(lst)
+    for (i, r) in parallel_imap(fn, lst, workers, timeout):
+        results[i] = r
+    return results
+
+
+def parallel_failed(result):
+    """Test whether a result from parallel_map or parallel_imap signals
+    a timeout or an error in the worker."""
+    return isinstance(result, str) and result.startswith('NO DATA')
+
+
 # helper function writing simple tests
 def test_it(*args):
     """Testing helper function. With an even number of arguments, with a
@@ -78,23 +143,143 @@ def test_it(*args):
     else:
         return False, problems
 
-def memoize_instance(f):
-    """Method decorator: Memoize a method, by storing the dict with the
-    already computed results in a slot of the object. We only memoize
-    on the first parameter.
-    """
-    slot_name = "_m_" + f.__name__
+def memo_key(x):
+    """Turn x into something hashable which identifies it for memoization.
+    Elements with a parent are keyed together with the parent, so 1 in
+    ZZ and 1 in QQ do not share a cache entry. Mutable sage objects
+    (matrices, vectors) are keyed through an immutable copy, lists and
+    dicts through tuples. Other unhashable objects raise TypeError, as
+    nothing (certainly not their repr) identifies them reliably."""
+    if isinstance(x, (list, tuple)):
+        return (type(x).__name__,) + tuple(map(memo_key, x))
+    elif isinstance(x, dict):
+        return ('dict', frozenset((memo_key(k), memo_key(v)) for (k, v) in x.items()))
+    try:
+        hash(x)
+    except TypeError:
+        if hasattr(x, 'set_immutable'):
+            x = copy(x)
+            x.set_immutable()
+        else:
+            raise TypeError("Cannot memoize on {0}".format(type(x).__name__))
+    if hasattr(x, 'parent') and callable(x.parent):
+        return (x.parent(), x)
+    else:
+        return x
 
-    def m(_self, x, *args):
-        if not hasattr(_self, slot_name):
-            _self.__dict__[slot_name] = dict()
-        if x in _self.__dict__[slot_name]:
-            return _self.__dict__[slot_name][x]
+
+class MemoCache(object):
+    """The cache of one memoized method for one object: a dict which
+    keeps at most maxsize entries (if given), dropping the least
+    recently used ones, and counts hits and misses."""
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        _memo_caches.add(self)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, key):
+        """Return a pair (found, value)."""
+        if key in self.entries:
+            self.hits += 1
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            return True, value
         else:
-            v = f(_self, x, *args)
-            _self.__dict__[slot_name][x] = v
+            self.misses += 1
+            return False, None
+
+    def store(self, key, value):
+        self.entries[key] = value
+        if self.maxsize is not None:
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'maxsize': self.maxsize, 'size': len(self.entries)}
+
+_memo_caches = weakref.WeakSet()
+
+
+def memoize_method(maxsize=None):
+    """Method decorator factory: Memoize a method on all its arguments,
+    storing a MemoCache with at most maxsize entries in a slot of the
+    object. Calls with arguments memo_key cannot handle bypass the
+    cache. The decorated method gets a cache_info function, which
+    sums up the statistics over all objects. See also memo_clear and
+    memo_info.
+    """
+    def dec(f):
+        slot_name = "_m_" + f.__name__
+        caches = weakref.WeakSet()
+
+        def m(_self, *args, **kwds):
+            cache = _self.__dict__.get(slot_name)
+            if cache is None:
+                cache = MemoCache(maxsize)
+                caches.add(cache)
+                _self.__dict__[slot_name] = cache
+            try:
+                key = memo_key(args)
+                if kwds:
+                    key = (key, memo_key(kwds))
+            except TypeError:
+                return f(_self, *args, **kwds)
+            found, v = cache.lookup(key)
+            if not found:
+                v = f(_self, *args, **kwds)
+                cache.store(key, v)
             return v
-    return m
+
+        def cache_info():
+            infos = [c.info() for c in caches]
+            return {'hits': sum(i['hits'] for i in infos),
+                    'misses': sum(i['misses'] for i in infos),
+                    'maxsize': maxsize,
+                    'size': sum(i['size'] for i in infos)}
+
+        m.__name__ = f.__name__
+        m.__doc__ = f.__doc__
+        m.cache_info = cache_info
+        return m
+    return dec
+
+
+def memoize_instance(f):
+    """Method decorator: Memoize a method, by storing the results in a
+    slot of the object. This is memoize_method without a size bound,
+    so we memoize on all the parameters.
+    """
+    return memoize_method()(f)
+
+
+def memo_info(obj):
+    """Return the statistics of all the memoized methods of obj, as a
+    dict indexed by method name."""
+    return {name[3:]: c.info() for (name, c) in obj.__dict__.items()
+            if name.startswith("_m_") and isinstance(c, MemoCache)}
+
+
+def memo_clear(obj=None):
+    """Clear the caches of all memoized methods of obj, or of all objects
+    if obj is None."""
+    if obj is None:
+        caches = list(_memo_caches)
+    else:
+        caches = [c for (name, c) in obj.__dict__.items()
+                  if name.startswith("_m_") and isinstance(c, MemoCache)]
+    for c in caches:
+        c.clear()
 
 def lazy_property(f):
     """
@@ -203,6 +388,13 @@ def multi_map(fn, lst):
     else:
         return fn(lst)
 
+def multi_leaves(lst):
+    """The entries of a nested list, in the order multi_map visits them."""
+    if isinstance(lst, list):
+        return [y for x in lst for y in multi_leaves(x)]
+    else:
+        return [lst]
+
 def table_builder(header, sep, contents):
     """Produce table output, to be used with org-babel. If sep is True,
     insert a horizontal line before the table body. If header is True,
@@ -279,35 +471,179 @@ def l(*args):
 
 # lazy sequences
 
+class _Evicted(object):
+    """Marker for a link to an element which was dropped from a bounded
+    ComputedElementStore."""
+    pass
+
+_evicted = _Evicted()
+
+
+class ComputedElementStore(object):
+    """Index the computed elements of a ComputableDoubleLinkedList by
+    their absolute index. If max_size is given, keep at most that many
+    elements besides the checkpoints (every checkpoint_every-th
+    element), dropping the least recently used ones. Dropped elements
+    get recomputed from the nearest stored element when needed again.
+
+    Computing new elements happens while holding compute_lock, so a
+    background Prefetch and the main thread never compute the same
+    element twice.
+    """
+    def __init__(self, max_size=None, checkpoint_every=32):
+        assert max_size is None or max_size >= 2
+        self.max_size = max_size
+        self.checkpoint_every = checkpoint_every
+        self.checkpoints = {}
+        self.elements = OrderedDict()
+        self.low = 0
+        self.high = 0
+        self.compute_lock = threading.RLock()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.checkpoints) + len(self.elements)
+
+    def is_checkpoint(self, i):
+        return self.max_size is None or i % self.checkpoint_every == 0
+
+    def add(self, element):
+        i = element._index
+        with self._lock:
+            self.low = min(self.low, i)
+            self.high = max(self.high, i)
+            if self.is_checkpoint(i):
+                self.checkpoints[i] = element
+            else:
+                self.elements.pop(i, None)
+                self.elements[i] = element
+                while len(self.elements) > self.max_size:
+                    j, old = self.elements.popitem(last=False)
+                    old._unlink()
+
+    def get(self, i):
+        """Return the stored element at index i, or None."""
+        if i in self.checkpoints:
+            return self.checkpoints[i]
+        with self._lock:
+            if i in self.elements:
+                # mark as recently used
+                element = self.elements.pop(i)
+                self.elements[i] = element
+                return element
+        return None
+
+    def nearest(self, i):
+        """Return the stored element closest to index i, preferring
+        those below i (so we may compute forward from there)."""
+        for j in xrange(min(i, self.high), self.low - 1, -1):
+            element = self.get(j)
+            if element is not None:
+                return element
+        for j in xrange(max(i, self.low), self.high + 1):
+            element = self.get(j)
+            if element is not None:
+                return element
+        raise IndexError("No element stored near {0}".format(i))
+
+    def lookup(self, i):
+        """Return the element at index i, computing it (and the elements
+        leading to it) if necessary."""
+        element = self.get(i)
+        if element is not None:
+            return element
+        element = self.nearest(i)
+        while element._index < i:
+            element = element.next()
+        while element._index > i:
+            element = element.prev()
+        return element
+
+
 class ComputableDoubleLinkedList(object):
-    """A base class for infinite sequences that get computed on the fly."""
+    """A base class for infinite sequences that get computed on the fly.
+    All elements of one sequence share a ComputedElementStore, so
+    indexing is a dictionary lookup for elements already computed. To
+    bound the memory used, set cache_size (and maybe
+    cache_checkpoints) in a subclass. Use prefetch to compute elements
+    in a background thread; new elements only get published in the
+    store once next or prev returns them, so other threads never see
+    half initialised elements."""
+    cache_size = None
+    cache_checkpoints = 32
+
     def __init__(self, prev=None, next=None, start=0):
         self._prev = prev
         self._next = next
-        if prev is not None:
+        if isinstance(prev, ComputableDoubleLinkedList):
             self._index = prev._index + 1
+            self._store = prev._store
+        elif isinstance(next, ComputableDoubleLinkedList):
+            self._index = next._index - 1
+            self._store = next._store
         else:
             self._index = 0
+            self._store = ComputedElementStore(self.cache_size, self.cache_checkpoints)
+            self._store.add(self)
+
+    def _publish(self, element):
+        if isinstance(element, ComputableDoubleLinkedList):
+            self._store.add(element)
+        return element
+
+    def _unlink(self):
+        """Called when the store drops this element: remove the links
+        between it and its neighbours, so it may be garbage collected."""
+        if isinstance(self._prev, ComputableDoubleLinkedList):
+            if self._prev._next is self:
+                self._prev._next = _evicted
+            self._prev = _evicted
+        if isinstance(self._next, ComputableDoubleLinkedList):
+            if self._next._prev is self:
+                self._next._prev = _evicted
+            self._next = _evicted
 
     def prev(self):
         if self._prev is None:
             raise IndexError("No prev at {0}".format(self._index))
-        elif self._prev is Ellipsis:
-            self._prev = self.compute_prev()
+        elif self._prev is Ellipsis or self._prev is _evicted:
+            # recompute forward from an element further down, if possible
+            if (self._prev is _evicted and
+                    self._store.nearest(self._index - 1)._index < self._index):
+                self._prev = self._store.lookup(self._index - 1)
+            else:
+                with self._store.compute_lock:
+                    if self._prev is Ellipsis or self._prev is _evicted:
+                        self._prev = self._publish(self.compute_prev())
         return self._prev
 
     def next(self):
         if self._next is None:
             raise IndexError("No next at {0}".format(self._index))
-        elif self._next is Ellipsis:
-            self._next = self.compute_next()
+        elif self._next is Ellipsis or self._next is _evicted:
+            with self._store.compute_lock:
+                if self._next is Ellipsis or self._next is _evicted:
+                    self._next = self._publish(self.compute_next())
         return self._next
 
+    def _adopt(self, store, index):
+        # join the sequence of a neighbour given after construction
+        if store is not self._store:
+            self._store = store
+            self._index = index
+            store.add(self)
+
     def set_next(self, next):
         self._next = next
+        if isinstance(next, ComputableDoubleLinkedList):
+            self._adopt(next._store, next._index - 1)
+            self._publish(next)
 
     def set_prev(self, prev):
         self._prev = prev
+        if isinstance(prev, ComputableDoubleLinkedList):
+            self._adopt(prev._store, prev._index + 1)
+            self._publish(prev)
 
     def has_next(self):
         return (self._next is not None)
@@ -321,23 +657,79 @@ class ComputableDoubleLinkedList(object):
     def compute_prev(self):
         return None
 
+    def index(self):
+        return self._index
+
+    def nth(self, n):
+        """Return the element with absolute index n (the first element of
+        the sequence has index 0)."""
+        return self._store.lookup(n)
+
     def __getitem__(self, i):
-        if i == 0:
-            return self
-        elif i > 0:
-            element = self
-            for j in xrange(i):
+        """Return the element i steps after (or before, if negative) this one."""
+        return self._store.lookup(self._index + i)
+
+    def prefetch(self, n, callback=None):
+        """Start computing the elements up to absolute index n in a
+        background thread, and return the Prefetch handle. Elements can
+        be read as usual while this is running."""
+        return Prefetch(self, n, callback)
+
+
+class Prefetch(object):
+    """Compute the elements of a ComputableDoubleLinkedList up to
+    absolute index target in a background thread. If given, callback
+    is called with the index of every newly computed element. The
+    computation may be stopped with cancel; any exception is kept and
+    raised again by wait.
+    """
+    def __init__(self, start, target, callback=None):
+        self.target = target
+        self.current = start._index
+        self.callback = callback
+        self.error = None
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(start,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, element):
+        try:
+            while element._index < self.target and not self._cancelled.is_set():
+                if not element.has_next():
+                    break
                 element = element.next()
-            return element
-        elif i < 0:
-            element = self
-            for j in xrange(-i):
-                element = element.prev()
-            return element
-        else:
-            raise IndexError("No item at {0}".format(i))
+                if element is None:
+                    break
+                self.current = element._index
+                if self.callback is not None:
+                    self.callback(self.current)
+        except Exception as e:
+            self.error = e
+
+    def cancel(self):
+        """Stop after the element currently being computed."""
+        self._cancelled.set()
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def done(self):
+        return not self._thread.is_alive()
+
+    def progress(self):
+        """Return the index of the last computed element and the target."""
+        return self.current, self.target
+
+    def wait(self, timeout=None):
+        """Wait for the computation to finish (or timeout seconds), and
+        return whether it is done."""
+        self._thread.join(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.done()
+
 
-
 # polynomial helpers
 
 def ensure_field(field_or_char):
@@ -394,12 +786,20 @@ def sqrt_workaround(number):
     return sqrt(number)
 
 
-def complete_square(poly):
+def complete_square(poly, method='coefficients'):
     """We expect an univariate polynomial of even degree, where the
     leading coefficient is a square, then we try to find a polynomial
     whose square is as close as possible to the original polynomial.
     Return two values, the first being the polynomial best
-    approximating the square root, the second being the rest."""
+    approximating the square root, the second being the rest.
+
+    By default, we work on the lists of coefficients, touching only
+    those which change in each step; method='polynomial' uses
+    polynomial arithmetic instead."""
+    if method == 'coefficients':
+        return _complete_square_coefficients(poly)
+    elif method != 'polynomial':
+        raise ValueError("Unknown method {0}".format(method))
     a = poly
     x, = gens(poly.parent())
     deg = poly.degree()
@@ -414,6 +814,46 @@ def complete_square(poly):
     return b, a
 
 
+def _complete_square_coefficients(poly, lc=None):
+    """complete_square on coefficient lists: with b = sum(B[k] x^k), the
+    step a -= c x^j (2b + c x^j) only changes the coefficients of a at
+    j + k for the k where B[k] is already known, and at 2j."""
+    deg = poly.degree()
+    assert (deg % 2 == 0)
+    n = deg // 2
+    if lc is None:
+        lc = sqrt_workaround(poly[deg])
+    # the ring in which the polynomial arithmetic would end up
+    K = (poly[0] / (2 * lc)).parent()
+    R = poly.parent().change_ring(K)
+    A = [K(c) for c in poly.list()]
+    B = [K(0)] * (n + 1)
+    B[n] = K(lc)
+    A[deg] = K(0)
+    two_lc = 2 * B[n]
+    for i in xrange(1, n + 1):
+        j = n - i
+        c = A[deg - i] / two_lc
+        # this coefficient cancels exactly
+        A[deg - i] = K(0)
+        for k in xrange(j + 1, n):
+            if B[k]:
+                A[j + k] -= 2 * c * B[k]
+        A[2 * j] -= c * c
+        B[j] = c
+    return R(B), R(A)
+
+
+def complete_squares(polys, workers=None):
+    """complete_square for many polynomials over the same parent,
+    optionally distributed over a pool of workers."""
+    polys = list(polys)
+    if len(polys) > 0:
+        P = polys[0].parent()
+        assert all(p.parent() is P for p in polys)
+    return parallel_map(_complete_square_coefficients, polys, workers)
+
+
 def normalise_monic(poly):
     "Make the polynomial or Laurent series monic."
     if is_Polynomial(poly):
@@ -465,14 +905,55 @@ def multivar_polynomials(field_or_char, var_desc, **args):
 
 # constructing polynomials
 
+def _coerces_into(ring, x):
+    if hasattr(x, 'parent') and callable(x.parent):
+        return ring.has_coerce_map_from(x.parent())
+    else:
+        return ring.has_coerce_map_from(type(x))
+
+
+def _poly_builder(var, lsts):
+    """Choose how poly_list builds polynomials in var from the
+    coefficient lists lsts: directly in the parent, if var generates a
+    univariate polynomial ring containing all the coefficients; by
+    summing powers for the symbolic ring (to keep expressions
+    expanded); by Horner's rule otherwise."""
+    if is_Polynomial(var) and var.parent().ngens() == 1 and var == var.parent().gen():
+        P = var.parent()
+        base = P.base_ring()
+        if all(_coerces_into(base, c) for lst in lsts for c in lst):
+            return lambda lst: P(lst)
+    if hasattr(var, 'parent') and callable(var.parent) and var.parent() is SR:
+        return lambda lst: sum([var**i * l for i, l in enumerate(lst)])
+
+    def horner(lst):
+        result = 0
+        for l in reversed(lst):
+            result = result * var + l
+        return result
+    return horner
+
+
 def poly_list(var, lst, reverse=False):
     """Given a variable (or actually any expression) and a list of
     coefficients, produce a polynomial in said variable. The reverse
     options makes the first element of lst the leading coefficient.
     """
+    lst = list(lst)
+    if reverse:
+        lst.reverse()
+    return _poly_builder(var, [lst])(lst)
+
+
+def poly_lists(var, lsts, reverse=False):
+    """poly_list for many lists of coefficients at once, deciding only
+    once how to build the polynomials."""
+    lsts = [list(lst) for lst in lsts]
     if reverse:
-        lst = reversed(lst)
-    return sum([var**i * l for i, l in enumerate(lst)])
+        for lst in lsts:
+            lst.reverse()
+    build = _poly_builder(var, lsts)
+    return [build(lst) for lst in lsts]
 
 
 def random_int_monic_polynomial(deg, limit=80, base=QQ):
@@ -480,10 +961,60 @@ def random_int_monic_polynomial(deg, limit=80, base=QQ):
     (default 80). The third optional parameter may be use to specify a
     different base than QQ."""
     R, X = polynomials(base)
-    poly = randint(0, limit) + X**deg
-    for i in xrange(1, deg):
-        poly += randint(0, limit) * X**i
-    return poly
+    if deg == 0:
+        # the constant term and X^0 add up
+        return R(randint(0, limit) + 1)
+    return R([randint(0, limit) for i in xrange(deg)] + [1])
+
+
+def _random_coefficients(rng, shape, limit, distribution):
+    if distribution == 'uniform':
+        return rng.randint(0, limit + 1, size=shape)
+    elif distribution == 'symmetric':
+        return rng.randint(-limit, limit + 1, size=shape)
+    elif distribution == 'normal':
+        return numpy.rint(rng.normal(0, limit, size=shape)).astype(numpy.int64)
+    elif callable(distribution):
+        return numpy.asarray(distribution(rng, shape), dtype=numpy.int64)
+    else:
+        raise ValueError("Unknown distribution {0}".format(distribution))
+
+
+def random_polynomials(deg, count=None, limit=80, base=QQ, monic=True,
+                       distribution='uniform', density=1.0, seed=None,
+                       batch=1024, var='X'):
+    """Generate count (or infinitely many) random polynomials of degree
+    deg over base, with integer coefficients. The coefficients are drawn
+    with numpy, batch polynomials at a time, so with the same seed we
+    get the same polynomials again.
+
+    distribution may be 'uniform' (from 0 to limit, like
+    random_int_monic_polynomial), 'symmetric' (from -limit to limit),
+    'normal' (rounded, with standard deviation limit), or a function
+    taking a numpy RandomState and a shape and returning an integer
+    array. With density below 1, every coefficient below the leading
+    one is zero with probability 1 - density; these draws come from a
+    separate generator, so the result does not depend on batch. Unless
+    monic, the leading coefficient is drawn like the others, but
+    replaced by 1 if zero.
+    """
+    R, X = polynomials(base, var)
+    rng = numpy.random.RandomState(seed)
+    if density < 1:
+        mask_rng = numpy.random.RandomState(rng.randint(0, 2**31 - 1))
+    produced = 0
+    while count is None or produced < count:
+        n = batch if count is None else min(batch, count - produced)
+        coeffs = _random_coefficients(rng, (n, deg + 1), limit, distribution)
+        if density < 1:
+            coeffs[:, :deg] *= (mask_rng.random_sample((n, deg)) < density)
+        if monic:
+            coeffs[:, deg] = 1
+        else:
+            coeffs[coeffs[:, deg] == 0, deg] = 1
+        for row in coeffs.tolist():
+            yield R(row)
+        produced += n
 
 
 def poly_over_varlist(varlist):
@@ -500,18 +1031,14 @@ def monic_free_polynomial(varlist):
     """Return a monic polynomial in X with the coefficients the elements of
     varlist, beginning with the constant coefficient."""
     X = poly_over_varlist(varlist)
-    deg = len(varlist)
-    poly = X**deg
-    for i, v in enumerate(varlist):
-        poly += v * X**i
-    return poly
+    return X.parent()(list(varlist) + [1])
 
 
 def free_polynomial(varlist):
     """Return a polynomial with coefficients the elements of varlist,
     beginning with the constant coefficient."""
     X = poly_over_varlist(varlist)
-    return sum([v * X**i for i, v in enumerate(varlist)])
+    return X.parent()(list(varlist))
 
 def poly_subs(poly, var, subs):
     """helper function to make polynomials out of symbolic expressions."""
@@ -616,13 +1143,22 @@ def poly_clear_constants(polynomial_fraction):
     return num_new / den_new
 
 
-def laurent_series_sqrt_with_lc(series, prec=10, lc=None, clear_constants=True):
+def laurent_series_sqrt_with_lc(series, prec=10, lc=None, clear_constants=True,
+                                method='quadratic', checkpoint=None):
     """Use this function to compute a square root of a Laurent series if
     sage cannot figure out what the leading coefficient of the sqrt
     should be -- you may supply it a parameter lc. The prec controls
     how many terms are computed, however be aware that the result
     might have the wrong O(X^n) term if the argument is not a
     polynomial (i.e. already has an O(X^m) term).
+
+    By default, the coefficients are computed one by one with the
+    straightforward recurrence. With method='newton', they are computed
+    by Newton iteration with precision doubling, which needs far fewer
+    multiplications for large prec, and method='fraction_free' runs
+    the recurrence without denominators (see
+    _sqrt_coefficients_fraction_free), normalising the coefficients
+    every checkpoint terms if that is given.
     """
     T, = series.parent().gens()
     v = series.valuation()
@@ -631,23 +1167,215 @@ def laurent_series_sqrt_with_lc(series, prec=10, lc=None, clear_constants=True):
     def c(n):
         return series[v + n]
 
-    b = []
     if lc is None:
         lc = sqrt(c(0))
 
-    b.append(lc)
+    b = _sqrt_coefficients(method, c, prec, lc, clear_constants, checkpoint=checkpoint)
 
-    for k in range(1, prec):
+    return O(T**(v//2 + prec)) + sum([b_n * T**(v//2 + i) for (i, b_n) in enumerate(b)])
+
+
+def _sqrt_coefficients_quadratic(c, prec, lc, clear_constants=True, b=None):
+    """Compute the first prec coefficients of the sqrt of the power
+    series with coefficients c(0), c(1), ... term by term. If b is
+    given, it should hold the already known first coefficients."""
+    b = [lc] if b is None else list(b)
+    for k in range(len(b), prec):
         # don't optimise the sum yet, it might make trouble
         s = c(k) - sum([b[i] * b[k-i] for i in range(1, k)])
         s = s/(2*lc)
         if clear_constants:
             s = poly_clear_constants(s)
         b.append(s)
+    return b
+
+
+def _sqrt_coefficients_newton(c, prec, lc, clear_constants=True, b=None):
+    """Compute the first prec coefficients of the sqrt of the power
+    series with coefficients c(0), c(1), ... using the Newton iteration
+    b -> (b + a/b)/2, which doubles the number of correct terms in
+    every step. If b is given, it should hold the already known first
+    coefficients, and the iteration starts from there."""
+    known = [lc] if b is None else list(b)
+    n = len(known)
+    if n >= prec:
+        return known[:prec]
+    # the coefficients of the sqrt live wherever c(0)/(2*lc) lives
+    K = (c(0) / (2 * lc)).parent()
+    P = PowerSeriesRing(K, 'T')
+    a = P([c(i) for i in range(prec)]).add_bigoh(prec)
+    b = P(known)
+    while n < prec:
+        n = min(2 * n, prec)
+        # b has to be exact, otherwise its precision limits that of a/b
+        b = ((b + a.add_bigoh(n) / b) / 2).truncate(n)
+        if clear_constants:
+            b = [poly_clear_constants(x) for x in b.padded_list(n)]
+        b = P(b)
+    # Newton iteration does not change the terms we already knew
+    return known + b.padded_list(prec)[len(known):]
+
+
+def _fraction_free_ring(field):
+    """Return an integral domain with the given fraction field, if we
+    know one, otherwise None. If we get a ring which is not a field,
+    we return it as is."""
+    if not field.is_field():
+        return field
+    elif field == QQ:
+        return ZZ
+    elif is_FractionField(field):
+        return field.ring()
+    else:
+        return None
+
+
+def _sqrt_coefficients_fraction_free(c, prec, lc, clear_constants=True, b=None,
+                                     checkpoint=None):
+    """Like _sqrt_coefficients_quadratic, but run the recurrence without
+    any division. Let D be the common denominator of the c(k) and U =
+    2*D*lc, then d_k = D * U^(2k-1) * b_k satisfies
+
+        d_k = U^(2k-2) * D^2 * c(k) - sum(d_i * d_(k-i), 0 < i < k)
+
+    so all the d_k live in the integral domain underlying the base.
+    Only at the end are the b_k recovered by a single division, and
+    then poly_clear_constants is applied once per coefficient. If
+    checkpoint is given, do this every checkpoint terms instead, so
+    long computations produce normalised terms along the way. If the
+    base has no suitable integral domain, fall back to the quadratic
+    recurrence."""
+    known = [lc] if b is None else list(b)
+    if checkpoint:
+        for stop in range(len(known) + checkpoint, prec, checkpoint):
+            known = _sqrt_coefficients_fraction_free(c, stop, lc, clear_constants, known)
+    n = len(known)
+    if n >= prec:
+        return known[:prec]
+    field = (c(0) / (2 * lc)).parent()
+    R = _fraction_free_ring(field)
+    if R is None:
+        return _sqrt_coefficients_quadratic(c, prec, lc, clear_constants, known)
+    field = R.fraction_field()
+    cs = [field(c(k)) for k in range(prec)]
+    D = R(lcm([x.denominator() for x in cs]))
+    U = R(2 * D * field(lc))
+    A = [R(D**2 * x) for x in cs]
+    d = [None] + [R(D * U**(2*i - 1) * field(known[i])) for i in range(1, n)]
+    U_pow = U**(2*n - 2)
+    for k in range(n, prec):
+        d.append(U_pow * A[k] - sum([d[i] * d[k-i] for i in range(1, k)]))
+        U_pow *= U**2
+    for k in range(n, prec):
+        s = field(d[k]) / (D * U**(2*k - 1))
+        if clear_constants:
+            s = poly_clear_constants(s)
+        known.append(s)
+    return known
+
+
+_sqrt_coefficient_methods = {'newton': _sqrt_coefficients_newton,
+                             'quadratic': _sqrt_coefficients_quadratic,
+                             'fraction_free': _sqrt_coefficients_fraction_free}
+
+def _sqrt_coefficients_method(method):
+    if method not in _sqrt_coefficient_methods:
+        raise ValueError("Unknown method {0}".format(method))
+    return _sqrt_coefficient_methods[method]
+
+
+def _sqrt_coefficients(method, c, prec, lc, clear_constants=True, b=None,
+                       checkpoint=None):
+    """Dispatch to the _sqrt_coefficients_* function for method. Only
+    method='fraction_free' supports a checkpoint."""
+    compute = _sqrt_coefficients_method(method)
+    if checkpoint is None:
+        return compute(c, prec, lc, clear_constants, b)
+    elif method != 'fraction_free':
+        raise ValueError("checkpoint needs method='fraction_free'")
+    return compute(c, prec, lc, clear_constants, b, checkpoint=checkpoint)
+
+
+class LazySqrtSeries(object):
+    """The square root of a Laurent series (or of a polynomial in X, as
+    a Laurent series in X^-1, like polynomial_laurent_sqrt), computed
+    lazily. The coefficients computed so far are kept, so asking for
+    more precision later only computes the new terms. lc,
+    clear_constants, method and checkpoint have the same meaning as for
+    laurent_series_sqrt_with_lc.
+    """
+    def __init__(self, series, lc=None, clear_constants=True, method='quadratic',
+                 checkpoint=None):
+        if is_Polynomial(series):
+            series = laurent_series_infinity_converter(series)(series)
+        v = series.valuation()
+        assert v % 2 == 0
+        self._series = series
+        self._valuation = v // 2
+        if lc is None:
+            lc = sqrt(self._c(0))
+        self._lc = lc
+        self._coefficients = [lc]
+        self.clear_constants = clear_constants
+        self.method = method
+        self.checkpoint = checkpoint
+
+    def _c(self, n):
+        return self._series[2 * self._valuation + n]
+
+    def valuation(self):
+        return self._valuation
+
+    def precision(self):
+        """The number of coefficients computed so far."""
+        return len(self._coefficients)
+
+    def extend(self, prec, checkpoint=None):
+        """Make sure at least the first prec coefficients are known. A
+        checkpoint given here overrides the one of the series."""
+        if prec <= len(self._coefficients):
+            return
+        if checkpoint is None:
+            checkpoint = self.checkpoint
+        self._coefficients = _sqrt_coefficients(self.method, self._c, prec, self._lc,
+                                                self.clear_constants, self._coefficients,
+                                                checkpoint)
+
+    def coefficient(self, i):
+        """Return the i-th coefficient, counting from the leading one."""
+        if i < 0:
+            return 0
+        self.extend(i + 1)
+        return self._coefficients[i]
+
+    def __getitem__(self, n):
+        """Return the coefficient of T^n, like for a Laurent series."""
+        return self.coefficient(n - self._valuation)
+
+    def series(self, prec=DEFAULT_SERIES_PREC):
+        """Return the sqrt as a Laurent series with prec terms."""
+        self.extend(prec)
+        T, = self._series.parent().gens()
+        v = self._valuation
+        b = self._coefficients[:prec]
+        return O(T**(v + prec)) + sum([b_n * T**(v + i) for (i, b_n) in enumerate(b)])
+
+
+class LazySeriesCoefficients(ComputableDoubleLinkedList):
+    """Walk through the coefficients of a LazySqrtSeries (or any other
+    object with a coefficient method) as a ComputableDoubleLinkedList.
+    All nodes share the same store, so coefficients are only ever
+    computed once, and subclasses may build further data on top of
+    self.value in their own __init__."""
+    def __init__(self, store, prev=None):
+        ComputableDoubleLinkedList.__init__(self, prev=prev, next=Ellipsis)
+        self.store = store
+        self.value = store.coefficient(self._index)
+
+    def compute_next(self):
+        return self.__class__(self.store, prev=self)
 
-    return O(T**(v//2 + prec)) + sum([b_n * T**(v//2 + i) for (i, b_n) in enumerate(b)])
 
-
 # various utilities for working with the symbolic ring
 
 def dsolve(expr, var):
@@ -668,24 +1396,257 @@ def subs_n(expr, *sbs):
     return expr
 
 
-def subs_nmap(lst, *sbs):
-    """Apply the given substitutions one after the other for every item in lst."""
+def subs_dict(s):
+    """Turn a substitution given as dict, equation or list of equations
+    into a dict."""
+    if isinstance(s, dict):
+        return dict(s)
+    elif isinstance(s, (list, tuple)):
+        d = {}
+        for x in s:
+            d.update(subs_dict(x))
+        return d
+    elif hasattr(s, 'lhs') and hasattr(s, 'rhs'):
+        return {s.lhs(): s.rhs()}
+    else:
+        raise TypeError("Cannot use {0} as substitution".format(s))
+
+
+def subs_compose(*sbs):
+    """Compose the substitutions into a single one, which has the same
+    effect as applying them one after the other (as subs_n does): every
+    later substitution is applied to the right hand sides of the earlier
+    ones, and adds its keys not yet replaced by them."""
+    composed = {}
+    for s in sbs:
+        s = subs_dict(s)
+        composed = {k: (v.subs(s) if hasattr(v, 'subs') else v)
+                    for (k, v) in composed.items()}
+        for (k, v) in s.items():
+            if k not in composed:
+                composed[k] = v
+    return composed
+
+
+def _subs_evaluator(parent, sub):
+    # if all keys are generators of the polynomial ring, evaluate
+    # instead of going through subs
+    gs = list(parent.gens())
+    values = list(gs)
+    for (k, v) in sub.items():
+        if not (hasattr(k, 'parent') and k.parent() is parent and k in gs):
+            return None
+        values[gs.index(k)] = v
+    return lambda p: p(*values)
+
+
+def subs_apply(lst, sub, workers=None):
+    """Apply the single substitution sub (a dict) to every item of lst.
+    Elements of polynomial rings are evaluated at the substituted
+    generators directly. With workers, the items are distributed over
+    a pool of processes."""
+    evaluators = {}
+
+    def apply(l):
+        if is_Polynomial(l) or is_MPolynomial(l):
+            P = l.parent()
+            if P not in evaluators:
+                evaluators[P] = _subs_evaluator(P, sub)
+            if evaluators[P] is not None:
+                return evaluators[P](l)
+        return l.subs(sub)
+    return parallel_map(apply, lst, workers)
+
+
+def subs_nmap(lst, *sbs, **options):
+    """Apply the given substitutions one after the other for every item in lst.
+
+    With compose=True, first combine the substitutions with
+    subs_compose, and apply the result in one pass per item with
+    subs_apply. With workers, the items are distributed over a pool of
+    processes.
+    """
+    workers = options.get('workers')
+    if options.get('compose', False):
+        return subs_apply(lst, subs_compose(*sbs), workers)
+    elif workers is not None and workers > 1:
+        return parallel_map(lambda l: subs_n(l, *sbs), lst, workers)
     return [subs_n(l, *sbs) for l in lst]
 
-def subs_in_unipoly(poly, *sbs):
-    deg = poly.degree() + 1
-    new_coeff = subs_nmap([poly[i] for i in range(deg)], *sbs)
+def _subs_in_coefficients(poly, sbs, options):
+    """Apply the substitutions (via subs_nmap, with the given options)
+    only to the non-zero coefficients of the univariate polynomial, and
+    return the full list of new coefficients."""
+    items = sorted(poly.dict().items())
+    new_coeff = [0] * (poly.degree() + 1)
+    substituted = subs_nmap([c for (e, c) in items], *sbs, **options)
+    for ((e, c), n) in zip(items, substituted):
+        new_coeff[e] = n
+    return new_coeff
+
+def subs_in_unipoly(poly, *sbs, **options):
+    """Apply the substitutions to the coefficients of the univariate
+    polynomial. Zero coefficients are skipped, and options (workers,
+    compose) are passed on to subs_nmap."""
+    new_coeff = _subs_in_coefficients(poly, sbs, options)
     return poly_list(poly.parent().gens()[0], new_coeff)
 
-def subs_in_unipoly1(poly, X, *sbs):
-    deg = poly.degree() + 1
-    new_coeff = subs_nmap([poly[i] for i in range(deg)], *sbs)
+def subs_in_unipoly1(poly, X, *sbs, **options):
+    """Like subs_in_unipoly, but produce a polynomial in X."""
+    new_coeff = _subs_in_coefficients(poly, sbs, options)
     # make sure the coefficients are contained in the right ring. This
     # is an issue if the base ring of X is contained in the original
     # domain (and no automatic coercion takes place?)
     rng = X.parent().base_ring()
     return poly_list(X, map(rng, new_coeff))
 
+# persistent cache for factorisations and gcds
+
+def canonical_text(x):
+    """A textual description of x which identifies it together with its
+    parent (including the term order for multivariate rings)."""
+    if hasattr(x, 'parent') and callable(x.parent):
+        P = x.parent()
+        desc = repr(P)
+        if hasattr(P, 'term_order'):
+            desc += " ordered by " + repr(P.term_order())
+        return desc + " | " + repr(x)
+    else:
+        return repr(x)
+
+
+def _negative_lc(x):
+    # polynomials with negative rational leading coefficient share their
+    # cache entry with their negative
+    if (is_Polynomial(x) or is_MPolynomial(x)) and x != 0:
+        lc = x.lc()
+        return lc in QQ and QQ(lc) < 0
+    return False
+
+
+class FactorCache(object):
+    """A persistent cache for the results of factor and gcd, kept in a
+    shelve file, so the results can be reloaded in a later session.
+    Entries are keyed on the canonical_text of the arguments. If there
+    are more than max_entries, the least recently used tenth of them is
+    dropped. The texts and last use times are kept in memory and in a
+    small separate shelve (written on misses and by sync), so hits
+    never rewrite the stored values."""
+    def __init__(self, filename, max_entries=10000):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.db = shelve.open(filename)
+        self.index_db = shelve.open(filename + '-index')
+        # key -> (text, last use)
+        self.index = dict((k, self.index_db[k]) for k in self.index_db.keys())
+        self.hits = 0
+        self.misses = 0
+        # forked workers must not write to the same file
+        self.pid = os.getpid()
+
+    def key(self, op, *args):
+        text = op + ": " + " ; ".join(map(canonical_text, args))
+        return op + ":" + hashlib.sha1(text.encode('utf-8')).hexdigest(), text
+
+    def compute(self, op, fn, *args):
+        """Return fn(*args), looking it up in the cache under op first."""
+        if os.getpid() != self.pid:
+            return fn(*args)
+        key, text = self.key(op, *args)
+        entry = self.index.get(key)
+        if entry is not None and entry[0] == text and key in self.db:
+            self.hits += 1
+            self.index[key] = (text, time.time())
+            return self.db[key]
+        self.misses += 1
+        value = fn(*args)
+        self.db[key] = value
+        self.index[key] = self.index_db[key] = (text, time.time())
+        if len(self.index) > self.max_entries:
+            self.evict(len(self.index) - self.max_entries + self.max_entries // 10)
+        return value
+
+    def _remove(self, k):
+        for d in [self.db, self.index_db, self.index]:
+            if k in d:
+                del d[k]
+
+    def evict(self, n):
+        """Drop the n least recently used entries."""
+        used = sorted((e[1], k) for (k, e) in self.index.items())
+        for (t, k) in used[:n]:
+            self._remove(k)
+
+    def entries(self):
+        """List the cached entries as [key, description, last use]."""
+        return sorted([[k, e[0], e[1]] for (k, e) in self.index.items()],
+                      key=lambda x: -x[2])
+
+    def invalidate(self, key_or_op=None):
+        """Remove a single entry (given its key), all entries for an
+        operation ('factor' or 'gcd'), or everything."""
+        for k in set(self.db.keys()) | set(self.index.keys()):
+            if key_or_op is None or k == key_or_op or k.startswith(key_or_op + ":"):
+                self._remove(k)
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.index), 'max_entries': self.max_entries}
+
+    def sync(self):
+        """Write the last use times to disk."""
+        for (k, e) in self.index.items():
+            self.index_db[k] = e
+        self.index_db.sync()
+        self.db.sync()
+
+    def close(self):
+        self.sync()
+        self.db.close()
+        self.index_db.close()
+
+
+factor_cache = None
+
+def enable_factor_cache(filename, max_entries=10000):
+    """Make factor0, irr_factors, collect_factors, pairwise_gcds and
+    friends consult a persistent FactorCache stored in filename."""
+    global factor_cache
+    disable_factor_cache()
+    factor_cache = FactorCache(filename, max_entries)
+    return factor_cache
+
+def disable_factor_cache():
+    global factor_cache
+    if factor_cache is not None:
+        factor_cache.close()
+    factor_cache = None
+
+
+def cached_factor(expr):
+    """factor, but looked up in the factor_cache if it is enabled."""
+    if factor_cache is None:
+        return factor(expr)
+    elif _negative_lc(expr):
+        F = factor_cache.compute('factor', factor, -expr)
+        return Factorization(list(F), unit=-F.unit(), sort=False, simplify=False)
+    else:
+        return factor_cache.compute('factor', factor, expr)
+
+
+def cached_gcd(a, b):
+    """gcd, but looked up in the factor_cache if it is enabled."""
+    if factor_cache is None:
+        return gcd(a, b)
+    if _negative_lc(a):
+        a = -a
+    if _negative_lc(b):
+        b = -b
+    if canonical_text(b) < canonical_text(a):
+        a, b = b, a
+    return factor_cache.compute('gcd', gcd, a, b)
+
+
 def factor0(expr):
     """Instead of producing an error message when factoring 0, just return
     0. This is very useful in conjunction with map or list
@@ -693,7 +1654,7 @@ def factor0(expr):
     if expr == 0:
         return 0
     else:
-        return factor(expr)
+        return cached_factor(expr)
 
 def irr_factors(expr):
     """Return a list of all the irreducible factors in expression, without
@@ -701,7 +1662,7 @@ def irr_factors(expr):
     if expr == 0:
         return []
     else:
-        return [f[0] for f in factor(expr)]
+        return [f[0] for f in cached_factor(expr)]
 
 def denom_irr_factors(expr):
     """Return a list of all the irreducible factors with negative
@@ -710,7 +1671,7 @@ def denom_irr_factors(expr):
     if expr == 0:
         return []
     else:
-        return [f[0] for f in factor(expr) if f[1] < 0]
+        return [f[0] for f in cached_factor(expr) if f[1] < 0]
 
 def numer_irr_factors(expr):
     """Return a list of all the irreducible factors with positive
@@ -719,17 +1680,34 @@ def numer_irr_factors(expr):
     if expr == 0:
         return []
     else:
-        return [f[0] for f in factor(expr) if f[1] > 0]
+        return [f[0] for f in cached_factor(expr) if f[1] > 0]
 
 
-def psolve(polys, variables, solution_field=None):
+def psolve(polys, variables, solution_field=None, method='sr'):
     """
     Given a list of polynomials and variables, solve the equations poly
     = 0 for the variables. Return a dictionary with the solutions, if any
     are found.
+
+    With method='sr' (the default), convert everything to the
+    SymbolicRing and use solve. With method='poly', use psolve_poly,
+    which stays in the polynomial ring, but only finds solutions in its
+    fraction field. With method='auto', use psolve_poly if that is
+    where we look for solutions anyway, and the SymbolicRing otherwise
+    or if psolve_poly cannot handle the system (it raises
+    NotImplementedError for everything it does not support).
     """
+    fraction_field = polys[0].parent().fraction_field()
     if solution_field is None:
-        solution_field = polys[0].parent().fraction_field()
+        solution_field = fraction_field
+    if method == 'poly' or (method == 'auto' and solution_field == fraction_field):
+        try:
+            return psolve_poly(polys, variables, solution_field)
+        except NotImplementedError:
+            if method == 'poly':
+                raise
+    elif method not in ['auto', 'sr']:
+        raise ValueError("Unknown method {0}".format(method))
     sp = map(SR, polys)
     sv = map(SR, variables)
     ssol = dsolve(sp, sv)
@@ -740,6 +1718,49 @@ def psolve(polys, variables, solution_field=None):
         psol.append({x: y for (x, y) in zip(variables, psl)})
     return psol
 
+
+def psolve_poly(polys, variables, solution_field=None):
+    """
+    Like psolve, but without leaving the polynomial ring: the other
+    generators of the ring are treated as parameters, and we compute
+    the variety of the ideal generated by polys over the field of
+    rational functions in the parameters. Only solutions in this field
+    (hence in solution_field) are found. Raise NotImplementedError if
+    the system has infinitely many solutions, or if Singular or the
+    root finding over the parameter field cannot handle it.
+    """
+    R = polys[0].parent()
+    if solution_field is None:
+        solution_field = R.fraction_field()
+    names = [str(v) for v in variables]
+    params = [g for g in R.gens() if str(g) not in names]
+    if len(params) > 0:
+        K = PolynomialRing(R.base_ring(), params).fraction_field()
+        param_gens = dict(zip(map(str, params), K.ring().gens()))
+        from_params = K.ring().hom(params, R)
+        back = lambda x: (solution_field(from_params(x.numerator())) /
+                          solution_field(from_params(x.denominator())))
+    else:
+        K = R.base_ring()
+        back = solution_field
+    S = PolynomialRing(K, names, order='lex')
+    to_S = R.hom([S(str(g)) if str(g) in names else S(K(param_gens[str(g)]))
+                  for g in R.gens()], S)
+    I = S.ideal([to_S(p) for p in polys])
+    try:
+        dim = I.dimension()
+        if dim == 0:
+            sols = I.variety()
+    except (TypeError, ValueError, ArithmeticError, RuntimeError) as e:
+        # RuntimeError is what Singular failures come as
+        raise NotImplementedError("Cannot solve over {0}: {1}".format(K, e))
+    if dim < 0:
+        return []
+    elif dim > 0:
+        raise NotImplementedError("Infinitely many solutions")
+    return [{v: back(sol[S(str(v))]) for v in variables} for sol in sols]
+
+
 def num_simpl(x):
     """
     Take the numerator of an expression, and divide by its content.
@@ -753,13 +1774,60 @@ def num_simpl(x):
     else:
         return n/c
 
-def eq_resolve(co, var, choice=0, full=True):
+# the report of the last call to simplify_all
+simplify_report = []
+
+def simplify_all(exprs, full=True, workers=None, timeout=None, fallback=True,
+                 verbose=False):
+    """
+    full_simplify (or if full is False, simplify; if None, do nothing
+    to) every expression. With workers, use a pool of processes, and
+    with a timeout (in seconds), give up on any expression taking
+    longer. For those, use simplify() instead if fallback is True,
+    otherwise keep them unsimplified. The global simplify_report gets a
+    list [index, seconds, status] for every expression, where status is
+    'ok', 'timeout' or 'error'; with verbose, the problematic ones are
+    also printed.
+    """
+    if full is None:
+        return list(exprs)
+    elif full:
+        simpm = lambda x: x.full_simplify()
+    else:
+        simpm = lambda x: x.simplify()
+
+    def timed(x):
+        start = time.time()
+        r = simpm(x)
+        return r, time.time() - start
+    exprs = list(exprs)
+    results = parallel_map(timed, exprs, workers, timeout or 0)
+    simplified = []
+    # clear in place, so simplify_report imported elsewhere stays valid
+    del simplify_report[:]
+    for (i, (x, r)) in enumerate(zip(exprs, results)):
+        if parallel_failed(r):
+            status = 'timeout' if 'timed out' in r else 'error'
+            seconds = timeout if status == 'timeout' else None
+            if verbose:
+                print("debug {0} while simplifying {1}".format(status, i))
+            simplified.append(x.simplify() if fallback else x)
+        else:
+            status = 'ok'
+            seconds = r[1]
+            simplified.append(r[0])
+        simplify_report.append([i, seconds, status])
+    return simplified
+
+
+def eq_resolve(co, var, choice=0, full=True, workers=None, timeout=None):
     """
     Take the len(var) first equations in co, and solve them for
     everything in var, the resubstitute the solution selected by
     choice into the equations, and unless full==False, full_simplify
     the results. Return the solution_dict and the still to be solved
-    equations.
+    equations. The simplification is done by simplify_all, with the
+    given workers and timeout.
     """
     l = len(var)
     if l == 1:
@@ -767,28 +1835,19 @@ def eq_resolve(co, var, choice=0, full=True):
     print("debug l = {0}".format(l))
     sol = dsolve(co[:l], var)
     print(sol)
-    simpm = lambda x: x.full_simplify()
-    co_solved = map(simpm, subs_map(co[:l], sol[choice]))
+    co_solved = simplify_all(subs_map(co[:l], sol[choice]), True, workers, timeout)
     print(co_solved)
-    if full is None:
-        simpm = lambda x: x
-    elif not full:
-        simpm = lambda x: x.simplify()
-    co_new = map(simpm, subs_map(co[l:], sol[choice]))
+    co_new = simplify_all(subs_map(co[l:], sol[choice]), full, workers, timeout)
     lrepr(co_new)
     return sol, co_new
 
 
-def eq_replace(co, s, full=True):
+def eq_replace(co, s, full=True, workers=None, timeout=None):
     """
     Allow manual substitution into a list of equations, with the same
     interface as eq_resolve.
     """
-    if full:
-        simpm = lambda x: x.full_simplify()
-    else:
-        simpm = lambda x: x.simplify()
-    co_new = [simpm(x.subs(s)) for x in co]
+    co_new = simplify_all([x.subs(s) for x in co], bool(full), workers, timeout)
     lrepr(co_new)
     return s, co_new
 
@@ -817,17 +1876,61 @@ def linear_term_complexity(expr, v):
     mons = expr.coefficient(v).monomials()
     return sum([x.degree() for x in mons])
 
-def linear_term_complexity_chart(expr):
+def linear_term_analysis(expr, variables=None):
+    """
+    For a multivariate polynomial, walk through its monomials once and
+    return a dict mapping every variable in variables (by default
+    linear_terms_variables) which appears only as a linear term in expr
+    to the complexity of its linear coefficient, as computed by
+    linear_term_complexity. Other expressions are handled by
+    linear_terms and linear_term_complexity.
+    """
+    if variables is None:
+        variables = linear_terms_variables
+    if not is_MPolynomial(expr):
+        return {v: linear_term_complexity(expr, v) for v in variables
+                if expr.degree(v) == 1}
+    gens = expr.parent().gens()
+    indices = [gens.index(v) for v in variables]
+    degrees = dict((k, 0) for k in indices)
+    complexity = dict((k, 0) for k in indices)
+    for e in expr.exponents():
+        # only visit the non-zero exponents, as ETuples are sparse
+        nonzero = list(e.sparse_iter())
+        total = sum([d for (k, d) in nonzero])
+        for (k, d) in nonzero:
+            if k not in degrees:
+                continue
+            if d > degrees[k]:
+                degrees[k] = d
+            if d == 1:
+                complexity[k] += total - 1
+    return {v: complexity[k] for (v, k) in zip(variables, indices) if degrees[k] == 1}
+
+
+def linear_term_complexity_chart(expr, variables=None):
     """
     Produce a list of the variables appearing as linear term in expr,
-    sorted by the complexity of their coefficient.
+    sorted by the complexity of their coefficient. The variables to
+    look at default to linear_terms_variables.
     """
-    lt = linear_terms(expr)
-    ltc = [[l, linear_term_complexity(expr, l)] for l in lt]
+    if variables is None:
+        variables = linear_terms_variables
+    analysis = linear_term_analysis(expr, variables)
+    ltc = [[l, analysis[l]] for l in variables if l in analysis]
     ltc.sort(key=lambda x: x[1])
     return ltc
 
-
+
+def linear_term_complexity_charts(exprs, variables=None, workers=None):
+    """linear_term_complexity_chart for many expressions, optionally
+    distributed over a pool of workers."""
+    if variables is None:
+        variables = linear_terms_variables
+    return parallel_map(lambda e: linear_term_complexity_chart(e, variables),
+                        exprs, workers)
+
+
 # linear algebra
 def solve_u_r1(m):
     """
@@ -845,79 +1948,196 @@ def solve_u_r1(m):
         solution.insert(0, val)
     return vector(solution)
 
-
-# quotients
-
-def ensure_non_quotient(x):
-    """If required, lift the element."""
-    if is_MPolynomial(x):
-        return x
-    elif is_Polynomial(x):
-        return x
-    elif hasattr(x, 'lift'):  # duck typing ;-)
-        # print("debug have to lift {0}".format(x))
-        return x.lift()
-    else:
-        return x
 
-def quotient_compatible(f):
+def solve_u_r1_fraction_free(m, denominator=False):
     """
-    For all parameters of the function, lift them out of a QuotientRing
-    if necessary.
+    Like solve_u_r1, but without rational functions along the way: we
+    keep the solution as y/D, with the y_j and the common denominator D
+    in the base ring of m, and only divide at the end. Zero entries of
+    the matrix are skipped. If denominator is True, return y (itself a
+    generator of the kernel) and D instead.
     """
-    def fun(*args):
-        args_new = map(ensure_non_quotient, args)
-        return f(*args_new)
+    R = m.base_ring()
+    return _solve_u_r1_fraction_free(m, R, R(0), R(1), denominator)
 
-    return fun
 
-
-# measuring and visualising complexity of polynomials
+def _upper_row_positions(m):
+    """For every row i of m, the columns j > i with non-zero entries."""
+    rows = [[] for i in range(m.nrows())]
+    for (i, j) in m.nonzero_positions():
+        if j > i:
+            rows[i].append(j)
+    return rows
 
-# @quotient_compatible
-def poly_complexity(ref):
-    """Add up the degrees of all the monomials """
-    # need to add 1, otherwise constant polynomials return zero as well
-    if ref == 0:
-        return 0
-    elif is_NumberFieldElement(ref):
-        return 1
-    elif is_Polynomial(ref):
-        return 1 + sum([i for (i, j) in enumerate(ref.coefficients(sparse=False)) if j])
+
+def _solve_u_r1_fraction_free(m, R, zero, one, denominator=False):
+    """The work of solve_u_r1_fraction_free, with the ring R and its zero
+    and one passed in, so solve_u_r1_batch sets them up only once.
+
+    Instead of multiplying all the y_j found so far whenever we have to
+    scale by some f, we group them into epochs between two rescalings:
+    the actual y_j is raw[j] * scales[epoch[j]], so rescaling only
+    touches one factor per epoch, and every y_j is multiplied only once
+    at the end."""
+    n = m.nrows()
+    raw = [zero] * n + [one]
+    epoch = [0] * (n + 1)
+    scales = [one]
+    D = one
+    for (i, cols) in reversed(list(enumerate(_upper_row_positions(m)))):
+        partial = {}
+        for j in cols:
+            e = epoch[j]
+            partial[e] = partial.get(e, zero) + m[i, j] * raw[j]
+        s = sum([scales[e] * p for (e, p) in partial.items()], zero)
+        d = m[i, i]
+        # x_i = -s/(D*d), so scale everything by d (up to common factors)
+        g = gcd(s, d) if s != 0 else d
+        f = d // g
+        if f != 1:
+            scales = [c * f for c in scales] + [one]
+            D *= f
+        raw[i] = -(s // g)
+        epoch[i] = len(scales) - 1
+    y = vector(R, [r * scales[e] if r != 0 else r for (r, e) in zip(raw, epoch)])
+    if denominator:
+        return y, D
     else:
-        return 1 + sum([x.degree() for x in ref.monomials()])
+        return y / D
 
-def mcplx_repr(m):
-    """
-    Print out a matrix of polynomials, visualising the complexity of the cell contents.
-    """
-    print(m.str(rep_mapping=lambda x: str(poly_complexity(x))))
-    return sum([poly_complexity(x) for x in m.list()])
 
-
-# working with sets of polynomial equations
+def solve_u_r1_batch(ms, fraction_free=True, workers=None):
+    """Solve many upper triangular systems (see solve_u_r1) over the
+    same ring, optionally distributed over a pool of workers. The
+    ring setup for the fraction free solver is shared by all
+    systems."""
+    ms = list(ms)
+    if len(ms) == 0:
+        return []
+    R = ms[0].base_ring()
+    assert all(m.base_ring() is R for m in ms)
+    if not fraction_free:
+        return parallel_map(solve_u_r1, ms, workers)
+    zero, one = R(0), R(1)
+    return parallel_map(lambda m: _solve_u_r1_fraction_free(m, R, zero, one),
+                        ms, workers)
+
+
+def remainder_tree(n, tree, square=False):
+    """Reduce n modulo every element of the first level of the product
+    tree (or its square), descending the tree level by level."""
+    rems = [n]
+    for level in reversed(tree[:-1]):
+        rems = [rems[i // 2] % (x**2 if square else x) for (i, x) in enumerate(level)]
+    return rems
+
+
+def _euclidean_p(lst):
+    # the remainder tree needs integers or univariate polynomials over a field
+    return all(isinstance(x, (int, long, Integer)) or
+               (is_Polynomial(x) and x.parent().base_ring().is_field())
+               for x in lst)
+
+
+def shared_factor_flags(lst, others=None):
+    """For every element of lst, decide whether it has a non-trivial
+    common divisor with another element of lst (or with an element of
+    others, if given). For integers and univariate polynomials over a
+    field, this is the batch gcd using product and remainder trees:
+    with P the product of all elements, x shares a factor with the
+    others iff gcd(x, (P mod x^2)/x) != 1. Otherwise (e.g. for
+    multivariate polynomials), a gcd with a product of many elements
+    is more expensive than the pairwise gcds, so we compute those,
+    stopping for each element at the first non-trivial one."""
+    lst = list(lst)
+    flags = [False] * len(lst)
+    # zeros share every factor, and would kill the products
+    nonzero = [i for (i, x) in enumerate(lst) if x != 0]
+    for i in range(len(lst)):
+        if i not in nonzero:
+            flags[i] = True
+    xs = [lst[i] for i in nonzero]
+    if len(xs) == 0:
+        return flags
+    if others is None:
+        if len(xs) < len(lst):
+            # some other element is zero, so gcd(x, 0) = x
+            shared = [gcd(x, 0) != 1 for x in xs]
+        elif _euclidean_p(xs):
+            tree = product_tree(xs)
+            rems = remainder_tree(tree[-1][0], tree, square=True)
+            shared = [gcd(x, r // x) != 1 for (x, r) in zip(xs, rems)]
+        else:
+            shared = [False] * len(xs)
+            for i in range(len(xs)):
+                for j in range(i + 1, len(xs)):
+                    if shared[i] and shared[j]:
+                        continue
+                    if gcd(xs[i], xs[j]) != 1:
+                        shared[i] = shared[j] = True
+    else:
+        others = list(others)
+        P = prod(others) if _euclidean_p(xs + others) else 0
+        if P != 0:
+            tree = product_tree(xs)
+            rems = remainder_tree(P, tree)
+            shared = [gcd(x, r) != 1 for (x, r) in zip(xs, rems)]
+        else:
+            shared = [any(gcd(x, y) != 1 for y in others) for x in xs]
+    for (i, f) in zip(nonzero, shared):
+        flags[i] = f
+    return flags
+
 
-def pairwise_gcds(lst1, lst2=None, verbose=True, collect=False):
+def pairwise_gcds(lst1, lst2=None, verbose=True, collect=False, batch=False,
+                  workers=None, chunk_size=None):
     """
     Given one list, print out all non-trivial common divisors of pairs
     of list elements. Given two lists, print out all non-trivial
     common divisors of elements of the cartesian product.
+
+    With batch=True, first use shared_factor_flags to find the
+    elements which have a common divisor with any other one at all, and
+    compute pairwise gcds only among those. This only pays off for
+    integers and univariate polynomials over a field (where the batch
+    gcd is used), so for other inputs batch is ignored.
+
+    With workers, the pairs are split into chunks of chunk_size
+    (default: about four chunks per worker) which are handled by a
+    pool of processes. The output stays in the same order. The
+    workers do not use the factor_cache, as they cannot share it.
     """
     if lst2 is None:
         lst2 = lst1
         all = False
     else:
         all = True
+    if batch and _euclidean_p(list(lst1) + list(lst2)):
+        flags1 = shared_factor_flags(lst1, lst2 if all else None)
+        flags2 = shared_factor_flags(lst2, lst1) if all else flags1
+    else:
+        flags1 = [True] * len(lst1)
+        flags2 = [True] * len(lst2)
+    pairs = [(i, j) for i in range(len(lst1)) if flags1[i]
+             for j in range(len(lst2)) if flags2[j] and (all or i < j)]
+    if workers is None or workers <= 1:
+        # a generator, so verbose output appears as the gcds are found
+        gcds = ([i, j, cached_gcd(lst1[i], lst2[j])] for (i, j) in pairs)
+    else:
+        if chunk_size is None:
+            chunk_size = len(pairs) // (4 * workers) + 1
+
+        def chunk_gcds(chunk):
+            return [[i, j, gcd(lst1[i], lst2[j])] for (i, j) in chunk]
+        gcds = [x for c in parallel_map(chunk_gcds, chunks(pairs, chunk_size), workers)
+                for x in c]
     mapping = []
-    for i, l1 in enumerate(lst1):
-        for j, l2 in enumerate(lst2):
-            if (all or i < j):
-                g = gcd(l1, l2)
-                if g != 1:
-                    if verbose:
-                        print("i = {0}, j = {1}, gcd = {2}".format(i, j, g))
-                    if collect:
-                        mapping.append([i, j, g])
+    for (i, j, g) in gcds:
+        if g != 1:
+            if verbose:
+                print("i = {0}, j = {1}, gcd = {2}".format(i, j, g))
+            if collect:
+                mapping.append([i, j, g])
     if collect:
         return mapping
 
@@ -936,19 +2156,238 @@ def bijection_p(lst, n=None):
         r2[l[1]] = True
     return reduce(lambda x, y: x and y, r1 + r2)
 
-def pairwise_gcds_bijection(lst1, lst2):
+def pairwise_gcds_bijection(lst1, lst2, workers=None):
+    """Test whether the non-trivial gcds between elements of lst1 and
+    lst2 give a bijection (see bijection_p). The gcds are computed row
+    by row (with workers, in a pool of processes), and we stop as soon
+    as some element of lst1 has no common divisor with any element of
+    lst2, as then bijection_p can no longer hold."""
     assert len(lst1) == len(lst2)
-    return bijection_p(pairwise_gcds(lst1, lst2, verbose=False, collect=True), n=len(lst1))
+    # forked workers cannot share the factor_cache
+    gcd_fn = cached_gcd if workers is None or workers <= 1 else gcd
+
+    def row_gcds(i):
+        return [[i, j, g] for (j, g) in enumerate([gcd_fn(lst1[i], l2) for l2 in lst2])
+                if g != 1]
+    mapping = []
+    rows = parallel_imap(row_gcds, range(len(lst1)), workers)
+    try:
+        for (i, row) in rows:
+            if len(row) == 0:
+                return False
+            mapping.extend(row)
+    finally:
+        rows.close()
+    return bijection_p(mapping, n=len(lst1))
+
+def normalise_unit(poly):
+    """Normalise the polynomial up to units, the way factor presents its
+    irreducible factors: multivariate polynomials over QQ become
+    primitive with integer coefficients and positive leading
+    coefficient, other polynomials over fields become monic, and
+    otherwise we make the leading coefficient positive if possible."""
+    if not (is_Polynomial(poly) or is_MPolynomial(poly)) or poly == 0:
+        return poly
+    base = poly.base_ring()
+    if is_MPolynomial(poly) and base == QQ:
+        poly = poly * poly.denominator()
+        poly = poly / gcd(poly.coefficients())
+    elif base.is_field():
+        return poly / poly.lc()
+    lc = poly.lc()
+    if lc in QQ and QQ(lc) < 0:
+        return -poly
+    return poly
 
-def collect_factors(lst):
+
+def coprime_base(lst):
+    """Compute a gcd-free basis of the given polynomials: a list of
+    pairwise coprime non-constant polynomials, such that every element
+    of lst is a unit times a product of their powers."""
+    def constant_p(x):
+        return x.degree() <= 0
+    basis = []
+    todo = [x for x in lst if x != 0]
+    while todo:
+        a = todo.pop()
+        if constant_p(a):
+            continue
+        for (k, b) in enumerate(basis):
+            g = gcd(a, b)
+            if not constant_p(g):
+                # replace b by its refinement, and refine a further
+                basis.pop(k)
+                todo.extend([g, b // g, a // g])
+                break
+        else:
+            basis.append(a)
+    return basis
+
+
+def collect_factors(lst, refine=False):
     """
     Given a list of polynomials, produce the list of irreducible
     factors occuring in all of them.
+
+    With refine=True (for polynomials only), first compute a
+    coprime_base of the inputs, and factor only its elements. These
+    are pairwise coprime, so their irreducible factors are distinct
+    after normalise_unit, and nothing gets factored twice.
     """
-    factor_list = flatten([[y[0] for y in factor(x)] for x in lst if x not in QQ])
+    if refine and all(is_Polynomial(x) or is_MPolynomial(x) for x in lst):
+        factor_list = [normalise_unit(y[0])
+                       for b in coprime_base(lst) for y in cached_factor(b)]
+        factor_list.sort(key=poly_complexity)
+        return factor_list
+    factor_list = flatten([[y[0] for y in cached_factor(x)] for x in lst if x not in QQ])
     # make sure there is no trouble with signs
-    factor_list = [factor(x)[0][0] for x in factor_list]
+    factor_list = [cached_factor(x)[0][0] for x in factor_list]
     # print("debug factors {0}".format(factor_list))
     factor_list = list(set(factor_list))
     factor_list.sort(key=poly_complexity)
     return factor_list
+
+
+class FactorCollector(object):
+    """Collect the irreducible factors of polynomials (or rational
+    functions) arriving one at a time, for example from a loop over
+    eq_resolve. We keep a table of the distinct factors (normalised
+    with normalise_unit) with their total multiplicity, separately for
+    numerators and denominators. A new polynomial is first divided by
+    the factors we already know, and only what remains gets factored.
+    """
+    def __init__(self, polys=None):
+        self.numer = OrderedDict()
+        self.denom = OrderedDict()
+        self.count = 0
+        if polys is not None:
+            self.update(polys)
+
+    def _record(self, table, f, e):
+        f = normalise_unit(f)
+        table[f] = table.get(f, 0) + e
+
+    def _add_poly(self, poly, table):
+        rest = poly
+        for f in list(self.numer) + list(self.denom):
+            if rest.degree() <= 0:
+                break
+            if f.parent() is not rest.parent():
+                continue
+            e = 0
+            q, r = rest.quo_rem(f)
+            while r == 0:
+                rest = q
+                e += 1
+                q, r = rest.quo_rem(f)
+            if e > 0:
+                self._record(table, f, e)
+        if rest.degree() > 0:
+            for (f, e) in cached_factor(rest):
+                self._record(table, f, e)
+
+    def add(self, expr):
+        """Add the irreducible factors of expr to the tables."""
+        self.count += 1
+        if expr == 0 or expr in QQ:
+            return
+        if is_Polynomial(expr) or is_MPolynomial(expr):
+            self._add_poly(expr, self.numer)
+        elif is_FractionField(expr.parent()):
+            self._add_poly(expr.numerator(), self.numer)
+            self._add_poly(expr.denominator(), self.denom)
+        else:
+            for (f, e) in cached_factor(expr):
+                if e > 0:
+                    self._record(self.numer, f, e)
+                else:
+                    self._record(self.denom, f, -e)
+
+    def update(self, polys):
+        """Add all the elements of an iterable (which may be a generator)."""
+        for p in polys:
+            self.add(p)
+        return self
+
+    def numer_factors(self):
+        return sorted(self.numer, key=poly_complexity)
+
+    def denom_factors(self):
+        return sorted(self.denom, key=poly_complexity)
+
+    def factors(self):
+        """All the irreducible factors seen, sorted like collect_factors."""
+        fs = list(self.numer) + [f for f in self.denom if f not in self.numer]
+        return sorted(fs, key=poly_complexity)
+
+    def multiplicity(self, f):
+        """The total multiplicity of f, counted negatively in denominators."""
+        f = normalise_unit(f)
+        return self.numer.get(f, 0) - self.denom.get(f, 0)
+
+    def __contains__(self, f):
+        f = normalise_unit(f)
+        return f in self.numer or f in self.denom
+
+    def __len__(self):
+        return len(self.factors())
+
+
+# bulk factoring of matrices and nested lists
+
+def bulk_map(fn, data, workers=None, key=memo_key, adjust=None):
+    """Apply fn to every entry of a matrix or nested list (see
+    multi_map), but only once for entries with the same key (entries
+    for which key raises TypeError are never shared). The distinct
+    entries may be handled by a pool of workers. A matrix is
+    returned as a list of rows. If given, adjust(entry, result) turns
+    the result for the first entry with a key into the one for
+    entry."""
+    if is_Matrix(data):
+        data = [list(r) for r in data.rows()]
+    leaves = multi_leaves(data)
+    def safe_key(x):
+        try:
+            return key(x)
+        except TypeError:
+            # a fresh object equals nothing else
+            return object()
+    keys = map(safe_key, leaves)
+    distinct = OrderedDict()
+    for (k, x) in zip(keys, leaves):
+        distinct.setdefault(k, x)
+    results = dict(zip(distinct.keys(), parallel_map(fn, distinct.values(), workers)))
+    if adjust is None:
+        adjust = lambda x, r: r
+    entries = iter([adjust(x, results[k]) for (k, x) in zip(keys, leaves)])
+    return multi_map(lambda x: next(entries), data)
+
+
+def _unit_key(x):
+    return memo_key(normalise_unit(x))
+
+def _unit_ratio(x):
+    # the constant c with x = c * normalise_unit(x)
+    if (is_Polynomial(x) or is_MPolynomial(x)) and x != 0:
+        return x.lc() / normalise_unit(x).lc()
+    else:
+        return 1
+
+
+def bulk_factor0(data, workers=None):
+    """factor0 for every entry of a matrix or nested list. Entries which
+    agree up to a unit are factored only once."""
+    def adjust(x, F):
+        u = _unit_ratio(x)
+        if F == 0 or u == 1:
+            return F
+        return Factorization(list(F), unit=F.unit() * u, sort=False, simplify=False)
+    return bulk_map(lambda x: factor0(normalise_unit(x)), data, workers,
+                    key=_unit_key, adjust=adjust)
+
+
+def bulk_irr_factors(data, workers=None):
+    """irr_factors for every entry of a matrix or nested list. Entries
+    which agree up to a unit are factored only once."""
+    return bulk_map(lambda x: irr_factors(normalise_unit(x)), data, workers,
+                    key=_unit_key)
@@ -2,6 +2,10 @@
 
 from __future__ import print_function
 from sage_helpers import *
+from sage_valuations import *
+from sage_multimodular import *
+from sage.all import matrix, previous_prime, tmp_filename, sin, cos
+import numpy
 
 
 def test_latex_strip():
@@ -53,3 +57,314 @@ def test_bijection_p():
     bijection_p([[0, 0], [1, 1], [2, 3]]) == False
     bijection_p([[0, 0], [1, 1], [2, 3], [3, 2]]) == True
     bijection_p([[0, 0], [1, 1], [2, 2], [2, 2]]) == False
+
+def test_laurent_series_sqrt_with_lc():
+    L, Z = Laurent_series(0)
+    s = (1 + Z)**2 * (1 + 3 * Z + Z**4)
+    r1 = laurent_series_sqrt_with_lc(s, prec=20, method='newton')
+    r2 = laurent_series_sqrt_with_lc(s, prec=20, method='quadratic')
+    assert r1 == r2
+    assert (r1**2 - s).valuation() >= 20
+
+def test_lazy_sqrt_series():
+    f = X**6 + 3 * X**2 + X + 5
+    s = LazySqrtSeries(f)
+    r1 = s.series(10)
+    assert s.precision() == 10
+    r2 = s.series(25)
+    assert r2 == polynomial_laurent_sqrt(f, prec=25)
+    assert r1 == r2.add_bigoh(r1.prec())
+    nodes = LazySeriesCoefficients(s)
+    assert nodes[12].value == s.coefficient(12)
+
+def test_laurent_series_sqrt_fraction_free():
+    K, t = rational_functions(0)
+    L, Z = Laurent_series(K)
+    s = 1 + t * Z + Z**2 / (t + 1) + 3 * Z**5
+    r1 = laurent_series_sqrt_with_lc(s, prec=15, method='fraction_free')
+    r2 = laurent_series_sqrt_with_lc(s, prec=15, method='quadratic')
+    assert r1 == r2
+    r3 = laurent_series_sqrt_with_lc(s, prec=15, method='fraction_free', checkpoint=4)
+    assert r3 == r2
+    lazy = LazySqrtSeries(s, method='fraction_free', checkpoint=4)
+    assert lazy.series(15) == r2
+    lazy.extend(20, checkpoint=3)
+    assert lazy.precision() == 20
+
+class Squares(ComputableDoubleLinkedList):
+    cache_size = 4
+    cache_checkpoints = 8
+
+    def __init__(self, prev=None):
+        ComputableDoubleLinkedList.__init__(self, prev=prev, next=Ellipsis)
+        self.value = self._index**2
+
+    def compute_next(self):
+        return Squares(prev=self)
+
+def test_computable_double_linked_list_store():
+    s = Squares()
+    assert s[50].value == 2500
+    assert len(s._store) <= 4 + 50 // 8 + 1
+    assert s.nth(13).value == 169
+    assert s[50][-37].value == 169
+
+def test_prefetch():
+    s = Squares()
+    p = s.prefetch(40)
+    assert p.wait()
+    assert p.progress() == (40, 40)
+    assert s.nth(40).value == 1600
+
+class Memoized(object):
+    @memoize_method(maxsize=2)
+    def add(self, x, y=1):
+        return x + y
+
+def test_memoize_method():
+    m = Memoized()
+    assert m.add(1) == 2 and m.add(1) == 2 and m.add(1, y=2) == 3
+    assert m.add(ZZ(1)) == 2 and m.add(QQ(1)).parent() == QQ
+    info = memo_info(m)['add']
+    assert info['size'] == 2 and info['hits'] == 1
+    memo_clear(m)
+    assert memo_info(m)['add']['size'] == 0
+    # unhashable arguments without set_immutable are not cached
+    assert m.add(bytearray(b'a'), y=bytearray(b'b')) == bytearray(b'ab')
+    assert memo_info(m)['add']['size'] == 0
+
+def test_factor_cache():
+    R, x, y = multivar_polynomials(0, ['x', 'y'])
+    fn = tmp_filename()
+    c = enable_factor_cache(fn)
+    try:
+        p = (x**2 - y) * (x + y)**2
+        f1 = irr_factors(p)
+        f2 = irr_factors(-p)
+        assert set(f1) == set(f2)
+        assert factor0(-p) == factor(-p)
+        assert c.info()['hits'] >= 1
+        # the times survive reopening the cache
+        used = c.entries()
+        disable_factor_cache()
+        c = enable_factor_cache(fn)
+        assert c.entries() == used
+        irr_factors(p)
+        assert c.info()['hits'] >= 1
+        c.invalidate('factor')
+        assert c.info()['size'] == 0
+    finally:
+        disable_factor_cache()
+
+def test_pairwise_gcds_batch():
+    lst = [(X + 1) * (X - 2), X**2 + 3, (X - 2) * X, X + 5, X**3 - 1]
+    assert (pairwise_gcds(lst, verbose=False, collect=True, batch=True) ==
+            pairwise_gcds(lst, verbose=False, collect=True))
+    assert shared_factor_flags(lst) == [True, False, True, False, False]
+    R, a, b = multivar_polynomials(0, ['a', 'b'])
+    mlst = [(a + b) * a, b**2 + 1, (a + b) * (b - 1)]
+    assert shared_factor_flags(mlst) == [True, False, True]
+    assert shared_factor_flags(mlst, [a * b]) == [True, False, False]
+
+def test_pairwise_gcds_workers():
+    lst1 = [X + i for i in range(6)]
+    lst2 = [(X + i) * (X**2 + 1) for i in reversed(range(6))]
+    assert (pairwise_gcds(lst1, lst2, verbose=False, collect=True, workers=3) ==
+            pairwise_gcds(lst1, lst2, verbose=False, collect=True))
+    assert pairwise_gcds_bijection(lst1, lst2, workers=2)
+    assert not pairwise_gcds_bijection(lst1 + [X + 7], lst2 + [X])
+
+def test_collect_factors_refine():
+    R, x, y = multivar_polynomials(0, ['x', 'y'])
+    lst = [(x + y)**2 * (x - 2*y), -(x - 2*y) * (x**2 + y), 3 * x * (x + y), R(5)]
+    assert set(collect_factors(lst, refine=True)) == set(collect_factors(lst))
+
+def test_factor_collector():
+    R, x, y = multivar_polynomials(0, ['x', 'y'])
+    c = FactorCollector([(x + y)**2 * (x - y), (x - y) * (x**2 + y)])
+    c.add(R.fraction_field()(x / (x + y)))
+    assert set(c.factors()) == set(collect_factors([(x + y) * (x - y) * (x**2 + y) * x]))
+    assert c.multiplicity(x + y) == 1
+    assert c.multiplicity(-x + y) == 2
+
+def test_bulk_factor0():
+    R, x, y = multivar_polynomials(0, ['x', 'y'])
+    m = matrix(R, [[x**2 - y**2, y**2 - x**2], [0, 2 * x + 2 * y]])
+    f = bulk_factor0(m)
+    assert [[F if F == 0 else F.expand() for F in r] for r in f] == [list(r) for r in m.rows()]
+    l = irr_factors(x * y)
+    assert bulk_irr_factors([[x * y, [-x * y]], 3 * x]) == [[l, [l]], [x]]
+
+def test_complete_square_methods():
+    p = 4 * X**6 + X**5 - 3 * X**2 + 7
+    assert complete_square(p) == complete_square(p, method='polynomial')
+    assert complete_squares([p, X**2 + 1]) == [complete_square(p), complete_square(X**2 + 1)]
+    # monic over ZZ, where sqrt_workaround returns the int 1
+    Z, x = polynomials(ZZ, 'x')
+    q = x**4 + 3 * x**3 + x + 5
+    b, r = complete_square(q)
+    assert (b, r) == complete_square(q, method='polynomial')
+    assert b**2 + r == q
+
+def test_poly_list():
+    R, a, b = multivar_polynomials(0, ['a', 'b'])
+    assert poly_list(X, [1, 2, 3]) == 3 * X**2 + 2 * X + 1
+    assert poly_list(X, [1, 2, 3], reverse=True) == X**2 + 2 * X + 3
+    assert poly_list(a + b, [1, 0, 2]) == 2 * (a + b)**2 + 1
+    p = free_polynomial([a, b])
+    assert p == a + b * p.parent().gen()
+    assert poly_lists(X, [[1], [0, 1]]) == [1, X]
+
+def test_random_polynomials():
+    l1 = list(random_polynomials(5, count=10, seed=42, batch=3))
+    l2 = list(random_polynomials(5, count=10, seed=42))
+    assert l1 == l2 and len(l1) == 10
+    assert all(p.degree() == 5 and p.is_monic() for p in l1)
+    q = list(random_polynomials(7, count=5, monic=False, density=0.2,
+                                distribution='symmetric', seed=1))
+    assert all(p.degree() == 7 for p in q)
+    assert q == list(random_polynomials(7, count=5, monic=False, density=0.2,
+                                        distribution='symmetric', seed=1, batch=2))
+
+def test_subs_compose():
+    R, a, b, c = multivar_polynomials(0, ['a', 'b', 'c'])
+    lst = [a + b, a * c, b**2 - c]
+    sbs = [{a: b + 1}, {b: c**2}, {c: 2}]
+    assert subs_nmap(lst, *sbs, compose=True) == subs_nmap(lst, *sbs)
+    x, y = var('x y')
+    assert subs_compose(x == y + 1, {y: 3}) == {x: 4, y: 3}
+
+def test_subs_in_unipoly():
+    R, a, b = multivar_polynomials(0, ['a', 'b'])
+    S, Y = polynomials(R, 'Y')
+    p = a * Y**5 + (a + b) * Y**2 + b
+    assert subs_in_unipoly(p, {a: 2}) == 2 * Y**5 + (2 + b) * Y**2 + b
+    assert subs_in_unipoly(p, {a: 2}, workers=2) == subs_in_unipoly(p, {a: 2})
+    assert subs_in_unipoly1(p, X, {a: 1}, {b: 3}, compose=True) == X**5 + 4 * X**2 + 3
+
+def test_psolve_poly():
+    R, x, y, t = multivar_polynomials(0, ['x', 'y', 't'])
+    polys = [x - t * y, y**2 - 4]
+    sols = psolve(polys, [x, y], method='poly')
+    assert len(sols) == 2
+    for sol in sols:
+        assert all(p.subs(sol) == 0 for p in polys)
+    # with the default solution field, auto uses psolve_poly
+    assert psolve(polys, [x, y], method='auto') == sols
+    # irrational solutions need the SymbolicRing
+    S, u = polynomials(0, 'u')
+    assert len(psolve([u**2 - 2], [u], solution_field=SR, method='auto')) == 2
+
+def test_linear_term_complexity_chart():
+    R, x, y, z = multivar_polynomials(0, ['x', 'y', 'z'])
+    e = x * y**2 + z * y + z + x**2
+    vs = [x, y, z]
+    assert linear_term_complexity_chart(e, vs) == [[z, linear_term_complexity(e, z)]]
+    f = x * y + x * z**2 + y
+    assert linear_term_complexity_charts([e, f], vs) == [
+        linear_term_complexity_chart(e, vs),
+        [[l, linear_term_complexity(f, l)] for l in [y, x]]]
+
+def test_solve_u_r1_fraction_free():
+    R, t = polynomials(0, 't')
+    m = matrix(R, [[t, 0, 3, 1], [0, t + 1, 0, t], [0, 0, 2, t**2]])
+    assert solve_u_r1_fraction_free(m) == solve_u_r1(m)
+    y, D = solve_u_r1_fraction_free(m, denominator=True)
+    assert m * y == 0 and y[-1] == D
+    assert solve_u_r1_batch([m, m], workers=2) == [solve_u_r1(m)] * 2
+
+def test_bounded_height_enumeration():
+    pts = list(projective_points_of_bounded_height(2, 3))
+    assert len(pts) == len(set(map(tuple, pts))) == 145
+    hs = [projective_height(map(QQ, p)) for p in pts]
+    assert hs == sorted(hs) and max(hs) == 3
+    shards = [list(projective_points_of_bounded_height(2, 3, shard=k, shards=3))
+              for k in range(3)]
+    assert sorted(sum(shards, [])) == sorted(pts)
+    aff = list(affine_points_of_bounded_height(1, 3))
+    assert len(set(x for (x,) in aff)) == 15
+    assert all(affine_height(p) <= 3 for p in aff)
+    polys = list(polynomials_of_bounded_height(2, 2))
+    assert len(set(polys)) == 41
+    assert all(p.degree() == 2 and p.leading_coefficient() > 0 for p in polys)
+
+def test_multimodular_sqrt():
+    L, Z = Laurent_series(0)
+    # the first prime tried divides a denominator
+    p = previous_prime(MODULAR_START_PRIME)
+    s = 4 + Z / 3 + Z**2 / p + 5 * Z**3
+    r = laurent_series_sqrt_with_lc(s, prec=8, clear_constants=False)
+    assert multimodular_laurent_series_sqrt(s, prec=8) == r
+    assert multimodular_laurent_series_sqrt(s, prec=8, workers=2) == r
+    R, a, b = multivar_polynomials(0, ['a', 'b'])
+    M, W = Laurent_series(R.fraction_field(), 'W')
+    s = 1 + a * W + W**2 / (b + 1) + b * W**3
+    assert (multimodular_laurent_series_sqrt(s, prec=6) ==
+            laurent_series_sqrt_with_lc(s, prec=6, clear_constants=False))
+
+def test_batch_heights():
+    pts = [[QQ(1) / 2, QQ(-3), QQ(4) / 9], [QQ(6), QQ(-10), QQ(4)], [QQ(0), QQ(2) / 7, QQ(1)]]
+    hs = projective_heights(pts)
+    assert list(hs) == [projective_height(p) for p in pts]
+    assert list(affine_heights(pts)) == [affine_height(p) for p in pts]
+    nums = numpy.array([[1, -3, 4], [6, -10, 4], [0, 2, 1]])
+    dens = numpy.array([[2, 1, 9], [1, 1, 1], [1, 7, 1]])
+    assert list(projective_heights(nums, dens)) == list(hs)
+    assert list(affine_heights(nums, dens)) == [affine_height(p) for p in pts]
+    logs = projective_heights(nums, dens, log_heights='float')
+    assert all(abs(l - float(log(h))) < 1e-12 for (l, h) in zip(logs, hs))
+    assert all(log(h) in i for (i, h) in
+               zip(projective_heights(pts, log_heights='interval'), hs))
+    # the lcm of the denominators alone is close to 10^18
+    nums = numpy.array([[999953, 1, 1]])
+    dens = numpy.array([[999983, 999979, 999961]])
+    pt = [QQ(int(n)) / int(d) for (n, d) in zip(nums[0], dens[0])]
+    assert list(projective_heights(nums, dens)) == [projective_height(pt)]
+    try:
+        projective_heights(numpy.array([[1, 2], [0, 0]]))
+        assert False
+    except ValueError:
+        pass
+
+def test_gauss_valuation_content():
+    Z, x = polynomials(ZZ, 'x')
+    R, a, b = multivar_polynomials(0, ['a', 'b'])
+    polys = [12 * x**5 + 18 * x + 30,
+             X**3 / 4 + 6 * X / 5 + 2,
+             a**2 * b / 9 + 3 * a - QQ(27) / 2 * b**3]
+    primes = [2, 3, 5, 7]
+    for p in polys:
+        old = [min([valuation(c, q) for c in p.coefficients()]) for q in primes]
+        assert [gauss_valuation(p, q) for q in primes] == old
+        assert gauss_valuations(p, primes) == old
+    assert gauss_valuation(Z(0), 2) == infinity
+    assert gauss_valuations(R(0), primes) == [infinity] * len(primes)
+
+def test_simplify_all():
+    x = var('x')
+    exprs = [sin(x)**2 + cos(x)**2, (x**2 - 1) / (x - 1)]
+    assert simplify_all(exprs) == [1, x + 1]
+    assert [r[2] for r in simplify_report] == ['ok', 'ok']
+    assert simplify_all(exprs, workers=2) == [1, x + 1]
+    assert [r[0] for r in simplify_report] == [0, 1]
+    # far too little time, so we fall back to simplify
+    big = sum([sin(k * x)**2 + cos(k * x)**2 for k in range(1, 30)])
+    assert simplify_all([big], timeout=0.001) == [big.simplify()]
+    assert simplify_report == [[0, 0.001, 'timeout']]
+    assert simplify_all([big], timeout=0.001, fallback=False) == [big]
+
+def test_pairwise_gcds_batch_count(monkeypatch):
+    import sage_helpers
+    calls = [0]
+
+    def counting_gcd(a, b):
+        calls[0] += 1
+        return gcd(a, b)
+    monkeypatch.setattr(sage_helpers, 'gcd', counting_gcd)
+    R, a, b = multivar_polynomials(0, ['a', 'b'])
+    lst = [(a + b) * a, b**2 + 1, (a + b) * (b - 1), a - 2 * b]
+    plain = pairwise_gcds(lst, verbose=False, collect=True)
+    plain_calls, calls[0] = calls[0], 0
+    assert pairwise_gcds(lst, verbose=False, collect=True, batch=True) == plain
+    assert calls[0] <= plain_calls
+
@@ -0,0 +1,195 @@
+# -*- coding: utf-8; sage: t -*-
+
+# Square roots of Laurent series with coefficients in QQ or QQ(a, b,
+# ...), computed modulo many word sized primes. The images are
+# combined with CRT and rational reconstruction, which avoids the
+# coefficient swell of working over QQ directly.
+
+
+# imports
+from __future__ import print_function
+from sage.all import (QQ,
+                      GF,
+                      Integer,
+                      CRT_list,
+                      previous_prime,
+                      sqrt,
+                      O)
+from sage_helpers import (is_Polynomial,
+                          is_FractionField,
+                          parallel_map,
+                          laurent_series_infinity_converter,
+                          _sqrt_coefficients_newton)
+
+
+MODULAR_START_PRIME = 2**31
+
+
+def modular_setting(field):
+    """Given QQ or a fraction field of a polynomial ring over QQ, return
+    the polynomial ring (or None for QQ) whose coefficients we reduce
+    modulo primes."""
+    if field == QQ:
+        return None
+    elif is_FractionField(field) and field.ring().base_ring() == QQ:
+        return field.ring()
+    else:
+        raise ValueError("Cannot work modulo primes over {0}".format(field))
+
+
+def _key(e):
+    # univariate polynomials use int exponents, multivariate ones ETuples
+    if isinstance(e, (int, long, Integer)):
+        return int(e)
+    else:
+        return tuple(e)
+
+
+def reduce_mod_prime(x, ring, p):
+    """Map x from QQ or the fraction field of ring to GF(p) or the
+    fraction field of ring over GF(p). Raise ZeroDivisionError if p
+    divides some denominator."""
+    if ring is None:
+        return GF(p)(x)
+    ring_p = ring.change_ring(GF(p))
+    num = ring_p(x.numerator().change_ring(GF(p)))
+    den = ring_p(x.denominator().change_ring(GF(p)))
+    if den == 0:
+        raise ZeroDivisionError("{0} divides a denominator".format(p))
+    return ring_p.fraction_field()(num) / den
+
+
+def _image_data(x, ring):
+    """Turn a reduced element into picklable data: either an integer, or
+    the coefficient dicts of numerator and monic denominator."""
+    if ring is None:
+        return int(x.lift())
+    num = x.numerator()
+    den = x.denominator()
+    lc = den.lc()
+    return ({_key(e): int((c / lc).lift()) for (e, c) in num.dict().items()},
+            {_key(e): int((c / lc).lift()) for (e, c) in den.dict().items()})
+
+
+def _image_shape(data):
+    """The monomial supports of an image, used to spot unlucky primes."""
+    if data is None or len(data) == 0 or not isinstance(data[0], tuple):
+        return None
+    return tuple((tuple(sorted(n.keys())), tuple(sorted(d.keys())))
+                 for (n, d) in data)
+
+
+def _shape_size(shape):
+    return sum(len(n) + len(d) for (n, d) in shape)
+
+
+def sqrt_image(series, prec, lc, ring, p):
+    """Compute the first prec coefficients of the sqrt of series modulo
+    p, as returned by _image_data. Return None if p is a bad prime."""
+    v = series.valuation()
+    try:
+        lc_p = reduce_mod_prime(lc, ring, p)
+        cs = [reduce_mod_prime(series[v + k], ring, p) for k in range(prec)]
+    except ZeroDivisionError:
+        return None
+    if lc_p == 0:
+        return None
+    b = _sqrt_coefficients_newton(lambda k: cs[k], prec, lc_p, clear_constants=False)
+    return [_image_data(x, ring) for x in b]
+
+
+def _reconstruct_rational(residues, moduli):
+    m = reduce(lambda x, y: x * y, moduli)
+    return Integer(CRT_list(residues, moduli)).rational_reconstruction(m)
+
+
+def reconstruct_images(images, primes, ring, field):
+    """Recover the coefficients from their images modulo the given primes
+    with CRT and rational reconstruction. Raise ArithmeticError if the
+    primes are not enough yet."""
+    primes = list(primes)
+    if ring is None:
+        return [_reconstruct_rational([im[k] for im in images], primes)
+                for k in range(len(images[0]))]
+
+    def rebuild(dicts):
+        return ring({e: _reconstruct_rational([d[e] for d in dicts], primes)
+                     for e in dicts[0]})
+    result = []
+    for k in range(len(images[0])):
+        num = rebuild([im[k][0] for im in images])
+        den = rebuild([im[k][1] for im in images])
+        result.append(field(num) / den)
+    return result
+
+
+def multimodular_sqrt_coefficients(series, prec, lc=None, workers=None,
+                                   batch=None, max_primes=1000, verbose=False):
+    """Compute the first prec coefficients of the sqrt of the given
+    Laurent series over QQ or QQ(a, b, ...), modulo word sized
+    primes. After every batch of primes (by default one per worker),
+    we try to reconstruct the result, and stop as soon as the
+    reconstruction no longer changes when adding primes. Unlucky
+    primes are recognised by their smaller monomial supports and
+    discarded. The images for a batch are computed in parallel if
+    workers is given."""
+    field = series.parent().base_ring()
+    ring = modular_setting(field)
+    v = series.valuation()
+    assert v % 2 == 0
+    if lc is None:
+        lc = sqrt(series[v])
+    lc = field(lc)
+    if batch is None:
+        batch = max(workers or 1, 1)
+
+    primes = []
+    images = []
+    shape = None
+    previous = None
+    p = MODULAR_START_PRIME
+    tried = 0
+    while tried < max_primes:
+        new_primes = []
+        for i in range(batch):
+            p = previous_prime(p)
+            new_primes.append(p)
+        tried += batch
+        new_images = parallel_map(lambda q: sqrt_image(series, prec, lc, ring, q),
+                                  new_primes, workers)
+        for (q, im) in zip(new_primes, new_images):
+            if im is None:
+                continue
+            s = _image_shape(im)
+            if shape is not None and s != shape:
+                if _shape_size(s) < _shape_size(shape):
+                    continue
+                # the earlier primes were unlucky
+                primes, images, previous = [], [], None
+            shape = s
+            primes.append(q)
+            images.append(im)
+        if len(images) == 0:
+            continue
+        try:
+            current = reconstruct_images(images, primes, ring, field)
+        except (ArithmeticError, ValueError):
+            continue
+        if verbose:
+            print("debug {0} primes, stable = {1}".format(len(primes), current == previous))
+        if current == previous:
+            return current
+        previous = current
+    raise ArithmeticError("No stable reconstruction with {0} primes".format(max_primes))
+
+
+def multimodular_laurent_series_sqrt(series, prec=10, lc=None, workers=None, **args):
+    """Like laurent_series_sqrt_with_lc, but computing modulo many primes
+    (see multimodular_sqrt_coefficients). A polynomial in X is treated
+    like in polynomial_laurent_sqrt, as Laurent series in X^-1."""
+    if is_Polynomial(series):
+        series = laurent_series_infinity_converter(series)(series)
+    T, = series.parent().gens()
+    v = series.valuation()
+    b = multimodular_sqrt_coefficients(series, prec, lc, workers, **args)
+    return O(T**(v//2 + prec)) + sum([b_n * T**(v//2 + i) for (i, b_n) in enumerate(b)])
@@ -7,21 +7,55 @@ from sage.all import (valuation,
                       gcd,
                       log,
                       Integer,
-                      QQ)
+                      ZZ,
+                      QQ,
+                      RIF)
 from sage_helpers import (is_Polynomial,
+                          is_MPolynomial,
                           is_LaurentSeries,
                           is_PolynomialRing,
-                          polynomials)
+                          polynomials,
+                          QQ_poly)
 from sage.rings.number_field.number_field import is_NumberField
+import numpy
+import itertools
+import math
+from fractions import gcd as int_gcd
 
 
 # computing Gauss norms
 
+def _rational_setting(poly, primes):
+    """Check whether poly has coefficients in ZZ or QQ and the primes are
+    rational primes, so we may use content_and_denominator."""
+    return (poly.base_ring() in (ZZ, QQ)
+            and all([p in ZZ for p in primes]))
+
+
+def content_and_denominator(coefficients):
+    """Return the gcd of the numerators and the lcm of the denominators
+    of the given rational numbers. The p-adic Gauss norm is then the
+    valuation of the former minus the valuation of the latter (at most
+    one of them is non-zero)."""
+    g = Integer(0)
+    d = Integer(1)
+    for c in coefficients:
+        c = QQ(c)
+        d = d.lcm(c.denominator())
+        # once the gcd is 1, only the denominators matter
+        if g != 1:
+            g = g.gcd(c.numerator())
+    return g, d
+
+
 def gauss_valuation(poly, prime, prec=30):
-    """Compute the Gauss norm of the given polynomial, with prime
-    identifying the valuation."""
-    if is_Polynomial(poly):
-        return min([valuation(c, prime) for c in poly])
+    """Compute the Gauss norm of the given (univariate or multivariate)
+    polynomial, with prime identifying the valuation."""
+    if is_Polynomial(poly) or is_MPolynomial(poly):
+        if _rational_setting(poly, [prime]):
+            g, d = content_and_denominator(poly.coefficients())
+            return valuation(g, prime) - valuation(d, prime)
+        return min([valuation(c, prime) for c in poly.coefficients()] + [infinity])
     if is_LaurentSeries(poly):
         return series_valuation(poly, prime, prec)
     else:
@@ -29,6 +63,16 @@ def gauss_valuation(poly, prime, prec=30):
         return valuation(poly, prime)
 
 
+def gauss_valuations(poly, primes, prec=30):
+    """Compute the Gauss norms of the given polynomial for all the
+    primes in the list. Over QQ, the content and denominator are
+    computed only once."""
+    if (is_Polynomial(poly) or is_MPolynomial(poly)) and _rational_setting(poly, primes):
+        g, d = content_and_denominator(poly.coefficients())
+        return [valuation(g, p) - valuation(d, p) for p in primes]
+    return [gauss_valuation(poly, p, prec) for p in primes]
+
+
 def series_valuation(series, prime, prec=30):
     """Compute the Gauss norm of the given Laurent series, with prime
     identifying the valuation. For practical reasons, we use a simple
@@ -143,3 +187,167 @@ def affine_global_height(affine_point, abs_val=lambda x: x.abs()):
     """The affine logarithmic height function (works only over the rationals?)."""
     # use .numerical_approx() if we want a float
     return log(affine_height(affine_point, abs_val))
+
+
+# batch heights over the rationals
+
+def _numerators_denominators(points):
+    """Turn a list of points (or polynomials) with rational coordinates
+    into arrays of numerators and denominators, using Python integers,
+    so nothing overflows."""
+    rows = [p.coefficients() if is_Polynomial(p) else p for p in points]
+    rows = [[QQ(v) for v in r] for r in rows]
+    nums = numpy.array([[int(v.numerator()) for v in r] for r in rows], dtype=object)
+    dens = numpy.array([[int(v.denominator()) for v in r] for r in rows], dtype=object)
+    return nums, dens
+
+
+def _log_heights(heights, log_heights):
+    if log_heights is None:
+        return heights
+    elif log_heights == 'float':
+        if heights.dtype == object:
+            # math.log copes with integers too large for floats
+            return numpy.array([math.log(h) for h in heights])
+        return numpy.log(heights.astype(float))
+    elif log_heights == 'interval':
+        return numpy.array([RIF(Integer(h)).log() for h in heights], dtype=object)
+    else:
+        raise ValueError("Unknown log_heights {0}".format(log_heights))
+
+
+def projective_heights(points, denominators=None, log_heights=None):
+    """The projective exponential height of many points over QQ at once.
+    points is either a list of points (or polynomials, as for
+    projective_height), or a 2-dimensional integer array of numerators
+    with one row per point, in which case denominators is an array of
+    the same shape (default all ones). Return an array of heights, or
+    with log_heights='float' or 'interval', of the logarithmic heights
+    as floats or elements of RIF.
+
+    For a row with numerators n_i and denominators d_i, with L the lcm
+    of the d_i and G the gcd of the n_i, the height is max(|n_i| *
+    (L/d_i)) / G, so everything is done with integer array operations.
+    """
+    if isinstance(points, numpy.ndarray):
+        nums = points
+        dens = numpy.ones_like(nums) if denominators is None else numpy.asarray(denominators)
+        if nums.dtype != object and len(nums) > 0:
+            # max|n| * prod(d) bounds everything we compute, so if it
+            # might not fit into the integer type, use Python integers
+            bound = (abs(nums).max(axis=1).astype(float) *
+                     abs(dens).astype(float).prod(axis=1))
+            limit = float(numpy.iinfo(numpy.promote_types(nums.dtype, dens.dtype)).max)
+            if bound.max() >= limit / 2:
+                nums = nums.astype(object)
+                dens = dens.astype(object)
+    else:
+        nums, dens = _numerators_denominators(points)
+    L = numpy.lcm.reduce(dens, axis=1)
+    G = numpy.gcd.reduce(nums, axis=1)
+    zero = numpy.flatnonzero(G == 0)
+    if len(zero) > 0:
+        raise ValueError("Rows {0} have only zero coordinates".format(list(zero)))
+    heights = (abs(nums) * (L[:, None] // dens)).max(axis=1) // abs(G)
+    return _log_heights(heights, log_heights)
+
+
+def affine_heights(points, denominators=None, log_heights=None):
+    """The affine height of many points over QQ at once, see
+    projective_heights."""
+    if isinstance(points, numpy.ndarray):
+        ones = numpy.ones((points.shape[0], 1), dtype=points.dtype)
+        nums = numpy.hstack([points, ones])
+        if denominators is None:
+            dens = numpy.ones_like(nums)
+        else:
+            dens = numpy.hstack([numpy.asarray(denominators), ones])
+        return projective_heights(nums, dens, log_heights)
+    else:
+        return projective_heights([list(p.coefficients() if is_Polynomial(p) else p)
+                                   + [Integer(1)] for p in points],
+                                  log_heights=log_heights)
+
+
+# enumeration by height
+
+def _is_primitive(vector, h):
+    # the gcd divides h, so we can stop as soon as it drops to 1
+    g = h
+    for x in vector:
+        g = int_gcd(g, x)
+        if abs(g) == 1:
+            return True
+    return False
+
+
+def _vector_prefixes(length, h, leading_nonzero=False):
+    """Split the integer vectors of the given length with maximal
+    absolute value exactly h, and the first non-zero entry positive,
+    into blocks: generate pairs (prefix, free) such that the vectors
+    are the prefixes followed by any free entries in [-h, h], each
+    vector occurring exactly once. If leading_nonzero, the first entry
+    is never zero."""
+    inner = range(-h + 1, h)
+    full = range(-h, h + 1)
+    # i is the first position where +-h occurs
+    for i in range(length):
+        for head in itertools.product(inner, repeat=i):
+            if leading_nonzero and i > 0 and head[0] == 0:
+                continue
+            nonzero = [x for x in head if x != 0]
+            if nonzero and nonzero[0] < 0:
+                continue
+            for x in ([h, -h] if nonzero else [h]):
+                if i + 1 < length:
+                    # fix one more entry, to get smaller blocks
+                    for y in full:
+                        yield head + (x, y), length - i - 2
+                else:
+                    yield head + (x,), 0
+
+
+def primitive_vectors(length, bound, shard=0, shards=1, leading_nonzero=False):
+    """Generate the primitive integer vectors of the given length (gcd
+    1, first non-zero entry positive) with maximal absolute value at
+    most bound, in order of increasing height. To split the work over
+    several processes, pass shards and a shard index in range(shards):
+    the shards take turns at the blocks of _vector_prefixes, so each
+    does only its share of the work, and is still ordered by height.
+    bound=None enumerates forever."""
+    assert 0 <= shard < shards
+    heights = itertools.count(1) if bound is None else range(1, bound + 1)
+    n = 0
+    for h in heights:
+        full = range(-h, h + 1)
+        for (prefix, free) in _vector_prefixes(length, h, leading_nonzero):
+            if n % shards == shard:
+                for tail in itertools.product(full, repeat=free):
+                    v = prefix + tail
+                    if _is_primitive(v, h):
+                        yield map(Integer, v)
+            n += 1
+
+
+def projective_points_of_bounded_height(dim, bound, shard=0, shards=1):
+    """Generate the points of P^dim(QQ) with projective_height at most
+    bound, once each, in order of increasing height. Points are
+    represented by primitive integer coordinates with the first
+    non-zero one positive. See primitive_vectors for the sharding."""
+    return primitive_vectors(dim + 1, bound, shard, shards)
+
+
+def affine_points_of_bounded_height(dim, bound, shard=0, shards=1):
+    """Generate the points of QQ^dim with affine_height at most bound,
+    once each, in order of increasing height."""
+    for v in primitive_vectors(dim + 1, bound, shard, shards, leading_nonzero=True):
+        yield [QQ(x) / v[0] for x in v[1:]]
+
+
+def polynomials_of_bounded_height(deg, bound, ring=QQ_poly, shard=0, shards=1):
+    """Generate the polynomials of degree deg with coprime integer
+    coefficients, positive leading coefficient and projective_height
+    at most bound, in order of increasing height. Every polynomial in
+    ring up to scaling by a constant turns up exactly once."""
+    for v in primitive_vectors(deg + 1, bound, shard, shards, leading_nonzero=True):
+        yield ring(list(reversed(v)))